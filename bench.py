@@ -0,0 +1,261 @@
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import platform
+import subprocess
+import tempfile
+from typing import Any, Callable
+
+import scheme.genshin, scheme.starrail
+from db import ConnectionPool, Dataset, Scheme, PROFILES
+
+
+# example: uv run bench.py profiles
+#          uv run bench.py profiles --rows 100000 --profiles default interactive
+#          uv run bench.py suite --sizes 1000 10000 100000 --out bench.json
+#          uv run bench.py suite --sizes 1000000 --tables genshin_materials --compare bench.json
+
+
+TABLE = "bench_materials"
+COUNTRIES = ["Mondstadt", "Liyue", "Inazuma", "Sumeru", "Fontaine", "Natlan", "Nod_Krai"]
+
+# table name -> (scheme, seed rows used as templates)
+TABLES: dict[str, tuple[Scheme, list[dict]]] = {
+    "genshin_materials": (scheme.genshin.genshin_scheme, scheme.genshin.genshin_init_data),
+    "genshin_weapon": (scheme.genshin.genshin_weapon_scheme, scheme.genshin.genshin_weapon_init_data),
+    "starrail_materials": (scheme.starrail.starrail_scheme, scheme.starrail.starrail_init_data),
+}
+
+
+def make_rows(n: int, seed: int = 0) -> list[dict]:
+    rnd = random.Random(seed)
+    return [
+        {
+            "country": rnd.choice(COUNTRIES),
+            "open_day": rnd.randint(1, 3),
+            "item_name": f"item {i}",
+            "tier1_count": rnd.randint(0, 200),
+            "tier2_count": rnd.randint(0, 200),
+            "tier3_count": rnd.randint(0, 200),
+        }
+        for i in range(n)
+    ]
+
+
+def make_table_rows(table: str, n: int, seed: int = 0) -> list[dict]:
+    """
+    n rows of the table's scheme: the seed rows repeated with numbered names and random tier counts
+    """
+    create_scheme, templates = TABLES[table]
+    tiers = [c.name for c in create_scheme.column_list if c.name.startswith("tier")]
+    rnd = random.Random(seed)
+    rows = []
+    for i in range(n):
+        row = dict(templates[i % len(templates)])
+        row["item_name"] = f"{row['item_name']} {i}"
+        for t in tiers:
+            row[t] = rnd.randint(0, 200)
+        rows.append(row)
+    return rows
+
+
+def timed(func: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def bench_profile(db_file: str, profile: str, rows: list[dict], edits: int) -> dict[str, float]:
+    """
+    seconds taken by an import, single-row edits each in its own `with Dataset` (as cli.py does),
+    a full read and indexed lookups; a read-only profile only reads (the file is filled first)
+    """
+    results: dict[str, float] = {}
+    read_only = PROFILES[profile].read_only
+
+    def dataset() -> Dataset:
+        return Dataset(db_file, TABLE, create_scheme=scheme.genshin.genshin_scheme, profile=profile)
+
+    if read_only:
+        with Dataset(db_file, TABLE, create_scheme=scheme.genshin.genshin_scheme) as db:
+            db.store_many(rows)
+        ConnectionPool.get(db_file).close()
+    else:
+        def load():
+            with dataset() as db, db.transaction():
+                db.store_many(rows)
+        results["import"] = timed(load)
+
+        rnd = random.Random(1)
+        def edit():
+            for _ in range(edits):
+                with dataset() as db:
+                    db.update_where({"id": rnd.randint(1, len(rows))}, {"tier1_count": rnd.randint(0, 200)})
+        results[f"{edits} edits"] = timed(edit)
+
+    def read_all():
+        with dataset() as db:
+            db.dquery_all()
+    results["dquery_all"] = timed(read_all)
+
+    def lookups():
+        with dataset() as db:
+            for country in COUNTRIES:
+                for day in (1, 2, 3):
+                    db.lquery_constrain({"country": country, "open_day": day})
+    results["lookups"] = timed(lookups)
+
+    ConnectionPool.get(db_file, profile).close()
+    return results
+
+
+def bench_table(db_file: str, table: str, n: int, calls: int) -> list[dict[str, Any]]:
+    """
+    one result per operation: {"op", "seconds", "calls"}, seconds for all the calls
+    """
+    # cli imports prompt_toolkit, only the suite needs it
+    from cli import AppState, make_eqv, make_eqv_batch
+
+    create_scheme, _ = TABLES[table]
+    rows = make_table_rows(table, n)
+    results: list[dict[str, Any]] = []
+
+    def add(op: str, func: Callable[[], object], k: int = 1):
+        results.append({"op": op, "seconds": timed(func), "calls": k})
+
+    with Dataset(db_file, table, create_scheme=create_scheme) as db:
+        def store():
+            with db.transaction():
+                db.store_many(rows, analyze=False)
+        add("store_many", store)
+        db.analyze()
+        del rows
+
+        data: list[dict] = []
+        def read_all():
+            data.extend(db.dquery_all())
+        add("dquery_all", read_all)
+
+        # point lookups by the indexed, unique item_name
+        rnd = random.Random(1)
+        lookups = [{"item_name": rnd.choice(data)["item_name"]} for _ in range(calls)]
+        def lookup():
+            for constrain in lookups:
+                db.lquery_constrain(constrain)
+        add("lquery_constrain", lookup, calls)
+
+        ids = [rnd.randint(1, n) for _ in range(calls)]
+        def update():
+            with db.transaction():
+                for i in ids:
+                    db.update_where({"id": i}, {"tier1_count": i % 200})
+        add("update_where", update, calls)
+
+    add("eqv_batch", lambda: make_eqv_batch(data))
+    add("eqv_craftitem", lambda: [make_eqv(r) for r in data])
+    del data
+
+    state = AppState(db_file, table, create_scheme=create_scheme)
+    try:
+        add("AppState.load_data", state.load_data)
+        state.sort_enabled = 1
+        state.filter_enabled = state.has_filter
+        add("apply_filter_and_sort", state.apply_filter_and_sort)
+    finally:
+        # its database thread and connection
+        state.adb.close()
+    ConnectionPool.get(db_file).close()
+    return results
+
+
+def git_commit() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+
+def run_suite(tables: list[str], sizes: list[int], calls: int) -> dict[str, Any]:
+    report: dict[str, Any] = {
+        "commit": git_commit(),
+        "time": time.time(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "results": [],
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for table in tables:
+            for n in sizes:
+                db_file = os.path.join(tmp, f"{table}_{n}.db")
+                for r in bench_table(db_file, table, n, min(calls, n)):
+                    r.update(table=table, rows=n)
+                    report["results"].append(r)
+                    print(f"{table:<20}{n:>9} {r['op']:<24}{r['seconds']:>10.4f}s  ({r['calls']} call(s))")
+                os.remove(db_file)
+    return report
+
+
+def compare(old: dict[str, Any], new: dict[str, Any]):
+    """
+    print new / old time of every (table, rows, op) found in both
+    """
+    before = {(r["table"], r["rows"], r["op"]): r["seconds"] for r in old["results"]}
+    print(f"\nvs {old.get('commit')}: new / old seconds, > 1 is slower")
+    for r in new["results"]:
+        old_seconds = before.get((r["table"], r["rows"], r["op"]))
+        if old_seconds:
+            ratio = r["seconds"] / old_seconds
+            mark = "  <-" if ratio > 1.2 else ""
+            print(f"{r['table']:<20}{r['rows']:>9} {r['op']:<24}{ratio:>8.2f}{mark}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("profiles", help="time the connection profiles")
+    p.add_argument("--rows", type=int, default=20000)
+    p.add_argument("--edits", type=int, default=200, help="single-row updates, committed one by one")
+    p.add_argument("--profiles", nargs="+", choices=list(PROFILES), default=list(PROFILES))
+
+    p = sub.add_parser("suite", help="time Dataset / AppState / eqv on synthetic tables")
+    p.add_argument("--tables", nargs="+", choices=list(TABLES), default=list(TABLES))
+    p.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000, 100000], help="rows, up to 1000000")
+    p.add_argument("--calls", type=int, default=1000, help="lookups / updates per table")
+    p.add_argument("--out", default="bench.json", help="results file")
+    p.add_argument("--compare", metavar="FILE", help="results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    if args.command == "suite":
+        old = None
+        if args.compare:
+            with open(args.compare) as f:
+                old = json.load(f)
+        report = run_suite(args.tables, args.sizes, args.calls)
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"results wrote to {args.out}")
+        if old is not None:
+            compare(old, report)
+        sys.exit(0)
+
+    rows = make_rows(args.rows)
+    table: dict[str, dict[str, float]] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for profile in args.profiles:
+            # a new file each, journal_mode WAL stays with the file
+            table[profile] = bench_profile(os.path.join(tmp, f"{profile}.db"), profile, rows, args.edits)
+
+    names: list[str] = []
+    for results in table.values():
+        names.extend(n for n in results if n not in names)
+    print(f"{args.rows} rows, seconds")
+    print(f"{'profile':<12}" + "".join(f"{n:>14}" for n in names))
+    for profile, results in table.items():
+        print(f"{profile:<12}" + "".join(f"{results[n]:>14.4f}" if n in results else f"{'-':>14}" for n in names))
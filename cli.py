@@ -1,7 +1,11 @@
 import sys
 import asyncio
+import logging
+import sqlite3
+import argparse
 import datetime
-from typing import Callable, Any
+from typing import Callable, Any, Sequence
+from itertools import islice
 from dataclasses import dataclass, field
 
 from prompt_toolkit import Application, ANSI, PromptSession
@@ -20,8 +24,14 @@ from prompt_toolkit.lexers import Lexer
 from prompt_toolkit.widgets import Frame, Dialog, Button, Label
 from prompt_toolkit.styles import Style
 
-from db import Dataset, Scheme
-from craft import CraftItem
+from db import AsyncDataset, Dataset, Scheme, PROFILES, DEFAULT_CHUNK_SIZE, get_profile
+from array import array
+from columns import ColumnTable, KeyIndex
+
+from craft import CraftItem, Eqv, batch_eqv, eqv_sql, tier_columns, to_count
+from logger import logger, add_json_file, start_queue_logging, stop_queue_logging # type: ignore
+from metrics import metrics
+from writebehind import WriteBehind
 import scheme.genshin, scheme.starrail
 
 
@@ -35,28 +45,64 @@ class TableConfig:
     # 运行时生成的键
     generated_fields: list[str] = field(default_factory=lambda: ["eqv"])
     generators: dict[str, Callable[[dict[str, Any]], Any]] = field(default_factory=dict)
+    # 一次生成多行，优先于 generators
+    batch_generators: dict[str, Callable[[list[dict[str, Any]]], list[Any]]] = field(default_factory=dict)
 
     # 默认排序和其他排序键
     default_sort_key: Callable[[dict[str, Any]], Any] | None = None
     sort_keys: dict[int, Callable[[dict[str, Any]], Any]] = field(default_factory=dict)
     sort_texts: dict[int, str] = field(default_factory=dict)
+    # the column a sort orders by, if it is one: the view is sorted on the column itself
+    # instead of building every row for the key function
+    sort_columns: dict[int, str] = field(default_factory=dict)
+    # the same sorts as SQL ORDER BY expressions (given the table columns) for the virtual view,
+    # the primary key is appended to break ties
+    sql_sort_keys: dict[int, Callable[[list[str]], list[str]]] = field(default_factory=dict)
 
     make_blank: Callable[[list[str], Any], dict[str, Any]] | None = None
 
 
 def make_eqv(row: dict[str, Any]) -> CraftItem:
     return CraftItem(
-        # TODO: 目前是硬编码 3 开始是物品直到结尾，暂不更改
-        *(list(row.values())[3:]),
+        *(row[f] for f in tier_columns(row)),
         name=row.get("item_name", ""), only_eqv=True
     )
 
+def make_eqv_batch(rows: list[dict[str, Any]]) -> list[Eqv]:
+    if not rows:
+        return []
+    # 只取 tier 列，生成的 eqv 列不算
+    tier_fields = tier_columns(rows[0])
+    tiers = [array('q', [to_count(r.get(f)) for r in rows]) for f in tier_fields]
+    big, small = batch_eqv(tiers)
+    return [Eqv(float(b), int(s)) for b, s in zip(big, small)]
+
+def _in_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+def _like(old: Any, new: Any) -> Any:
+    # what sqlite will store for an edited text: the INTEGER / REAL columns keep numbers
+    if isinstance(new, str) and isinstance(old, (int, float)) and not isinstance(old, bool):
+        try:
+            return type(old)(new.strip())
+        except ValueError:
+            return new
+    return new
+
+def make_eqv_order(headers: list[str]) -> list[str]:
+    # 同 make_eqv，只取 tier 列；与 scheme 里 eqv 索引的表达式一致
+    return [eqv_sql(tier_columns(headers))]
+
 eqv_config = TableConfig(
     prikey_field="id",
     prikey_type=int,
     allow_edit_prikey=True,
     generated_fields=["eqv"],
-    generators={"eqv": make_eqv},
+    batch_generators={"eqv": make_eqv_batch},
     default_sort_key=lambda r: int(r["id"]),
     sort_keys={
         1: lambda r: r["eqv"],
@@ -64,7 +110,14 @@ eqv_config = TableConfig(
     sort_texts={
         0: "Sort: Default",
         1: "Sort: Eqv",
-    }
+    },
+    sort_columns={
+        0: "id",
+        1: "eqv",
+    },
+    sql_sort_keys={
+        1: make_eqv_order,
+    },
 )
 
 
@@ -75,17 +128,34 @@ class AppState:
         *,
         config: TableConfig = eqv_config,
         create_scheme: Scheme | None = None,
-        create_data: list[dict] | None = None
+        create_data: list[dict] | None = None,
+        virtual: bool = False,
+        prefetch: int = 50,
+        profile: str = "default",
+        write_behind: float | None = None,
     ):
+        """
+        virtual: keep only a window of the view in memory (the rows on screen plus `prefetch` rows
+        above and below), paged from the database by key, instead of the whole table
+        profile: connection profile of db.PROFILES, edits are refused with `read-only`
+        write_behind: keep cell edits in memory and write them together after this many idle
+                      seconds (or on flush()), journaled to `<db_file>.<table_name>.edits`; not in virtual mode
+        """
         self.db_file = db_file
         self.table_name = table_name
         self.config = config
         self.create_scheme = create_scheme
         self.create_data = create_data
+        self.virtual = virtual
+        self.prefetch = prefetch
+        self.profile = profile
+        self.read_only = get_profile(profile).read_only
 
         self.headers: list[str] = []
-        self.view_data: list[dict[str, Any]] = []
-        self.all_data: list[dict[str, Any]] = []
+        self.db_headers: list[str] = []
+        # the loaded rows, by column; the view is their positions in filter / sort order
+        self.table = ColumnTable([])
+        self.view: array = array('q')
 
         self.selected_row_index: int = 0
         self.selected_col_index: int = 0
@@ -102,35 +172,235 @@ class AppState:
         self.info_text: str = ""
 
         self.header_to_index: dict[str, int] = {}
-        self._cached_key_set: set[Any] = set()
-
+        # primary key -> position in self.table
+        self._pos_by_key = KeyIndex()
+        self._view_filter: tuple[str, Any] | None = None
+        self._data_version: int = 0
+        # changelog position of the loaded rows, None if the table does not track changes
+        self._change_seq: int | None = None
+
+        # virtual mode only: the rows of view index [_window_start, _window_start + len(_window)),
+        # their page keys, and the row counts of the view / table
+        self._window: list[dict[str, Any]] = []
+        self._window_keys: list[tuple] = []
+        self._window_start: int = 0
+        self._view_count: int = 0
+        self._total_count: int = 0
+        # inside an event loop the pages are read by a task on the database thread: rows not there
+        # yet show as placeholders, on_change() is called when they arrive (TableApp redraws);
+        # _window_gen goes up whenever the view changes, pages of an older one are dropped
+        self.on_change: Callable[[], None] | None = None
+        self._window_gen: int = 0
+        self._window_stale: bool = False
+        self._counts_stale: bool = False
+        self._window_want: tuple[int, int] = (0, 0)
+        self._window_tried: tuple[int, int, int] | None = None
+        self._window_task: asyncio.Task | None = None
+        # writes of update / insert / delete (and write-behind flushes) not finished yet,
+        # the reads (sync polls, pages) are not counted
+        self.saving: int = 0
+
+        # all reads and writes that keep `_data_version` run on this thread, on one connection
+        self.adb = AsyncDataset(
+            db_file, table_name,
+            create_scheme=create_scheme, create_data=create_data,
+            profile=profile, cache=True,
+        )
+        self.write_behind: WriteBehind | None = None
+        recovered = 0
+        busy = False
+        if write_behind is not None and not virtual:
+            try:
+                self.write_behind = WriteBehind(
+                    self.adb, config.prikey_field, f"{db_file}.{table_name}.edits", idle_seconds=write_behind,
+                )
+            except BlockingIOError as e:
+                # the journal is another cli.py's, its edits are not ours to replay: write at once
+                logger.warning("write-behind off: %s", e)
+                busy = True
+            else:
+                # edits a crashed run did not write, load_data() writes them first
+                recovered = self.write_behind.recover()
         self.load_data()
+        if recovered:
+            self.info_text = f"Recovered unsaved edits of {recovered} row(s)"
+        elif busy:
+            self.info_text = "Write-behind off: another cli.py holds the edits journal"
 
     def load_data(self):
-        with Dataset(
-            self.db_file, self.table_name,
-            create_scheme=self.create_scheme, create_data=self.create_data
-        ) as db:
-            db_headers = db.head_name()
-            self.all_data = db.dquery_all()
-
-        self.headers = db_headers[:]
-        self.has_filter = (self.filter_field_name in self.headers)
+        self.flush_sync()
+        self._apply_load(*self.adb.call(self._load_db))
 
-        for g in self.config.generated_fields:
-            if g not in self.headers:
-                self.headers.append(g)
+    async def load_data_async(self):
+        await self.flush()
+        self._apply_load(*await self.adb.run(self._load_db))
 
-        for row in self.all_data:
-            for g in self.config.generated_fields:
-                gen = self.config.generators.get(g)
-                row[g] = "" if gen is None else gen(row)
+    def flush_sync(self) -> int:
+        """
+        write the edits write-behind mode is holding, return the number of rows
+        """
+        return self.write_behind.flush_sync() if self.write_behind is not None else 0
+
+    async def flush(self) -> int:
+        if self.write_behind is None or not len(self.write_behind):
+            return 0
+        self.saving += 1
+        try:
+            return await self.write_behind.flush()
+        finally:
+            self.saving -= 1
+
+    async def _run_write(self, func: Callable[..., Any], *args: Any) -> Any:
+        # a write on the database thread, counted in `saving`
+        self.saving += 1
+        try:
+            return await self.adb.run(func, *args)
+        finally:
+            self.saving -= 1
+
+    def unsaved_count(self) -> int:
+        return len(self.write_behind) if self.write_behind is not None else 0
+
+    def _hold_update(self, old_prikey_value: Any, new_dict: dict) -> bool:
+        """
+        in write-behind mode, show a local row's update and queue it; False if it must be written now
+        (a primary key change, or a row not loaded)
+        """
+        if self.write_behind is None or self.config.prikey_field in new_dict:
+            return False
+        if old_prikey_value not in self._pos_by_key:
+            return False
+        self._show_update(old_prikey_value, new_dict)
+        self.write_behind.update(old_prikey_value, new_dict)
+        return True
+
+    def _load_db(self, db: Dataset) -> tuple[list[str], ColumnTable, int, int | None]:
+        # on the database thread: the rows go into the columns a chunk at a time
+        db_headers = db.head_name()
+        table = ColumnTable(db_headers + [g for g in self.config.generated_fields if g not in db_headers])
+        if not self.virtual:
+            rows = db.iter_all()
+            while chunk := list(islice(rows, DEFAULT_CHUNK_SIZE)):
+                values: dict[str, Sequence[Any]] = dict(zip(db_headers, zip(*chunk)))
+                if self.config.generated_fields:
+                    # the generators take row dicts, only for this chunk
+                    dicts = [dict(zip(db_headers, row)) for row in chunk]
+                    self._generate(dicts)
+                    for g in self.config.generated_fields:
+                        values[g] = [d[g] for d in dicts]
+                table.extend_columns(values, len(chunk))
+        return db_headers, table, db.data_version(), db.change_seq()
+
+    def _apply_load(self, db_headers: list[str], table: ColumnTable, data_version: int, change_seq: int | None):
+        self.table = table
+        self._data_version = data_version
+        self._change_seq = change_seq
+
+        self.headers = table.headers[:]
+        self.db_headers = db_headers
+        self.has_filter = (self.filter_field_name in self.headers)
 
         self.apply_filter_and_sort()
         self._rebuild_caches()
         self._normalize_selected_col()
 
+    async def pull_changes(self) -> int:
+        """
+        take in what other connections committed since we last looked: only the changed rows
+        when the table tracks changes (db.Scheme.track_changes), the whole table otherwise;
+        return the number of rows taken in, 0 if nothing changed
+        """
+        res = await self.adb.run(self._changes_db, self._data_version, self._change_seq)
+        if res is None:
+            await self.load_data_async()
+            return self.total_count()
+        self._data_version, self._change_seq, rows, gone = res
+        if not rows and not gone:
+            return 0
+        if self.virtual:
+            self._reset_window(keep_rows=True)
+            return len(rows) + len(gone)
+        for prikey_value in gone:
+            self._patch_row(prikey_value, None)
+        pending = self.write_behind.pending if self.write_behind is not None else {}
+        reload = False
+        for row in rows:
+            prikey_value = self._prikey_of(row)
+            # edits not written yet stay on top of the other connection's values
+            for k, v in pending.get(prikey_value, {}).items():
+                row[k] = _like(row.get(k), v)
+            reload = self._patch_row(prikey_value, row) or reload
+        if reload:
+            await self.load_data_async()
+        return len(rows) + len(gone)
+
+    def _changes_db(self, db: Dataset, data_version: int, change_seq: int | None) -> tuple[int, int | None, list[dict[str, Any]], list[Any]] | None:
+        # on the database thread: (data_version, change_seq, changed rows, deleted keys),
+        # None if the changes are not known and the table must be reloaded
+        version = db.data_version()
+        if version == data_version:
+            return version, change_seq, [], []
+        if change_seq is None:
+            return None
+        changes = db.changes_since(change_seq)
+        if changes is None:
+            return None
+        seq, ops = changes
+        cast = self.config.prikey_type
+        gone = [cast(key) for key, op in ops.items() if op == "D"]
+        rows = db.dquery_in(self.config.prikey_field, [key for key, op in ops.items() if op != "D"])
+        return version, seq, rows, gone
+
     def update(self, old_prikey_value: Any, new_dict: dict) -> bool:
+        prepared = self._prepare_update(old_prikey_value, new_dict)
+        if prepared is None:
+            return False
+        old_prikey_value, new_dict = prepared
+        if self._hold_update(old_prikey_value, new_dict):
+            return True
+        self.flush_sync()
+        error, res, new_row, version = self.adb.call(self._update_db, old_prikey_value, new_dict)
+        if error is not None:
+            self.info_text = error
+            return False
+        if self._apply_write(old_prikey_value, new_row, version):
+            self.load_data()
+        return res
+
+    async def update_async(self, old_prikey_value: Any, new_dict: dict, *, on_shown: Callable[[], None] | None = None) -> bool:
+        """
+        like update, but the row shows the new values at once (then on_shown() is called)
+        and is put back if the write fails
+        """
+        prepared = self._prepare_update(old_prikey_value, new_dict)
+        if prepared is None:
+            return False
+        old_prikey_value, new_dict = prepared
+        if self._hold_update(old_prikey_value, new_dict):
+            if on_shown is not None:
+                on_shown()
+            return True
+        shown_prikey_value, old_row = self._show_update(old_prikey_value, new_dict)
+        if on_shown is not None:
+            on_shown()
+        try:
+            await self.flush()
+            error, res, new_row, version = await self._run_write(self._update_db, old_prikey_value, new_dict)
+        except sqlite3.Error as e:
+            error, res, new_row, version = f"Update error: {e}", False, None, self._data_version
+        if error is not None:
+            self.info_text = error
+            if old_row is not None and self._patch_row(shown_prikey_value, self._strip_generated(old_row)):
+                await self.load_data_async()
+            return False
+        if self._apply_write(shown_prikey_value, new_row, version):
+            await self.load_data_async()
+        return res
+
+    def _prepare_update(self, old_prikey_value: Any, new_dict: dict) -> tuple[Any, dict] | None:
+        if self.read_only:
+            self.info_text = f"Read-only profile: {self.table_name} can not be changed"
+            return None
         pf = self.config.prikey_field
         new_dict = self._strip_generated(new_dict)
 
@@ -138,52 +408,168 @@ class AppState:
             old_prikey_value = self.config.prikey_type(old_prikey_value)
         except Exception:
             self.info_text = f"Update error: invalid {pf}={old_prikey_value!r}"
-            return False
+            return None
 
         if pf in new_dict:
             try:
-                new_prikey_value = self.config.prikey_type(new_dict[pf])
+                new_dict[pf] = self.config.prikey_type(new_dict[pf])
             except Exception:
                 self.info_text = f"Update error: {pf} must be int, got {new_dict[pf]!r}"
-                return False
-
-            if new_prikey_value != old_prikey_value:
-                with Dataset(self.db_file, self.table_name) as db:
-                    exists = db.dquery_constrain({pf: new_prikey_value})
-                if exists:
-                    self.info_text = f"Update error: {pf}={new_prikey_value} already exists"
-                    return False
+                return None
+        return old_prikey_value, new_dict
 
-            new_dict[pf] = new_prikey_value
+    def _update_db(self, db: Dataset, old_prikey_value: Any, new_dict: dict) -> tuple[str | None, bool, dict[str, Any] | None, int]:
+        # on the database thread: (error, result, the row as stored, data_version before the write)
+        pf = self.config.prikey_field
+        version = db.data_version()
+        new_prikey_value = new_dict.get(pf, old_prikey_value)
+        if new_prikey_value != old_prikey_value and db.lquery_constrain({pf: new_prikey_value}):
+            return f"Update error: {pf}={new_prikey_value} already exists", False, None, version
+        if not db.lquery_constrain({pf: old_prikey_value}):
+            return f"Update error: row {pf}={old_prikey_value} not found", False, None, version
+        res = db.update_where({pf: old_prikey_value}, new_dict)
+        new_rows = db.dquery_constrain({pf: new_prikey_value})
+        return None, res, new_rows[0] if new_rows else None, version
 
-        with Dataset(self.db_file, self.table_name) as db:
-            rows = db.dquery_constrain({pf: old_prikey_value})
-            if not rows:
-                self.info_text = f"Update error: row {pf}={old_prikey_value} not found"
-                return False
-            res = db.update_where({pf: old_prikey_value}, new_dict)
+    def delete(self, old_row_or_prikey_value: dict | Any) -> bool:
+        prikey_value = self._prepare_delete(old_row_or_prikey_value)
+        if prikey_value is None:
+            return False
+        self.flush_sync()
+        res, version = self.adb.call(self._delete_db, prikey_value)
+        if self._apply_write(prikey_value, None, version):
+            self.load_data()
+        return res
 
-        self.load_data()
+    async def delete_async(self, old_row_or_prikey_value: dict | Any, *, on_shown: Callable[[], None] | None = None) -> bool:
+        """
+        like delete, but the row goes away at once (then on_shown() is called) and comes back if the write fails
+        """
+        prikey_value = self._prepare_delete(old_row_or_prikey_value)
+        if prikey_value is None:
+            return False
+        old_row = self._row_by_key(prikey_value)
+        if old_row is not None:
+            self._patch_row(prikey_value, None)
+        if on_shown is not None:
+            on_shown()
+        try:
+            await self.flush()
+            res, version = await self._run_write(self._delete_db, prikey_value)
+        except sqlite3.Error as e:
+            self.info_text = f"Delete error: {e}"
+            if old_row is not None and self._patch_row(prikey_value, self._strip_generated(old_row)):
+                await self.load_data_async()
+            return False
+        if self._apply_write(prikey_value, None, version):
+            await self.load_data_async()
         return res
 
-    def delete(self, old_row_or_prikey_value: dict | Any) -> bool:
+    def _prepare_delete(self, old_row_or_prikey_value: dict | Any) -> Any:
+        if self.read_only:
+            self.info_text = f"Read-only profile: {self.table_name} can not be changed"
+            return None
         pf = self.config.prikey_field
         prikey_value = old_row_or_prikey_value[pf] if isinstance(old_row_or_prikey_value, dict) else old_row_or_prikey_value
-        with Dataset(self.db_file, self.table_name) as db:
-            res = db.delete({pf: self.config.prikey_type(prikey_value)})
-        self.load_data()
-        return res
+        return self.config.prikey_type(prikey_value)
+
+    def _delete_db(self, db: Dataset, prikey_value: Any) -> tuple[bool, int]:
+        version = db.data_version()
+        return db.delete({self.config.prikey_field: prikey_value}), version
 
     def insert(self, new_dict) -> bool:
-        new_dict = dict(new_dict)
-        new_dict = self._strip_generated(new_dict)
-        with Dataset(self.db_file, self.table_name) as db:
-            res = db.insert_or_update(new_dict)
-        self.load_data()
+        new_dict = self._prepare_insert(new_dict)
+        if new_dict is None:
+            return False
+        self.flush_sync()
+        res, new_row, version = self.adb.call(self._insert_db, new_dict)
+        if self._apply_write(self._prikey_of(new_dict), new_row, version, reload_if_missing=True):
+            self.load_data()
         return res
 
+    async def insert_async(self, new_dict, *, on_shown: Callable[[], None] | None = None) -> bool:
+        """
+        like insert, but the row shows at once (then on_shown() is called) and goes away if the write fails
+        """
+        new_dict = self._prepare_insert(new_dict)
+        if new_dict is None:
+            return False
+        prikey_value = self._prikey_of(new_dict)
+        shown = prikey_value is not None and not self.virtual and prikey_value not in self._pos_by_key
+        if shown:
+            self._patch_row(prikey_value, dict(new_dict))
+        if on_shown is not None:
+            on_shown()
+        try:
+            await self.flush()
+            res, new_row, version = await self._run_write(self._insert_db, new_dict)
+        except sqlite3.Error as e:
+            self.info_text = f"Add error: {e}"
+            if shown:
+                self._patch_row(prikey_value, None)
+            return False
+        if self._apply_write(prikey_value, new_row, version, reload_if_missing=True):
+            await self.load_data_async()
+        return res
+
+    def _prepare_insert(self, new_dict) -> dict | None:
+        if self.read_only:
+            self.info_text = f"Read-only profile: {self.table_name} can not be changed"
+            return None
+        return self._strip_generated(dict(new_dict))
+
+    def _insert_db(self, db: Dataset, new_dict: dict) -> tuple[bool, dict[str, Any] | None, int]:
+        pf = self.config.prikey_field
+        version = db.data_version()
+        # the row comes back from the INSERT itself (RETURNING)
+        new_row = db.upsert(new_dict)
+        if new_row is None and pf in new_dict:
+            # already stored as is, nothing written
+            new_rows = db.dquery_constrain({pf: new_dict[pf]})
+            new_row = new_rows[0] if new_rows else None
+        return new_row is not None, new_row, version
+
+    def _prikey_of(self, row: dict) -> Any:
+        try:
+            return self.config.prikey_type(row[self.config.prikey_field])
+        except Exception:
+            return None
+
+    def _apply_write(self, prikey_value: Any, new_row: dict[str, Any] | None, data_version: int, *, reload_if_missing: bool = False) -> bool:
+        """
+        patch the written row in, return True if the whole table must be reloaded instead:
+        another connection wrote the database since we last looked, or the row can not be found
+        """
+        external = data_version != self._data_version
+        self._data_version = data_version
+        if external or (reload_if_missing and new_row is None):
+            return True
+        return self._patch_row(prikey_value, new_row)
+
+    def _show_update(self, old_prikey_value: Any, new_dict: dict) -> tuple[Any, dict[str, Any] | None]:
+        """
+        put the edited values in the local row before the database has them,
+        return the key it shows under and the row it replaced
+        """
+        old_row = self._row_by_key(old_prikey_value)
+        if old_row is None:
+            return old_prikey_value, None
+        row = self._strip_generated(old_row)
+        for k, v in new_dict.items():
+            row[k] = _like(old_row.get(k), v)
+        shown_prikey_value = self._prikey_of(row)
+        if shown_prikey_value is None:
+            # _patch_row could not put it back in, leave it to the write
+            return old_prikey_value, None
+        if shown_prikey_value != old_prikey_value and shown_prikey_value in self._pos_by_key:
+            # the database will refuse it, do not hide the row it collides with
+            return old_prikey_value, None
+        self._patch_row(old_prikey_value, row)
+        return shown_prikey_value, old_row
+
     def apply_filter_and_sort(self):
 
+        self._view_filter = None
         if self.has_filter and self.filter_enabled:
             now = datetime.datetime.now()
             today_weekday = now.weekday()
@@ -197,45 +583,366 @@ class AppState:
                 key, value = self.filter_field_name, today_key_index
             if key:
                 self.filter_text = f"Filter: {key}={value}"
-                self.view_data = [row for row in self.all_data if str(row.get(key, '')) == str(value)]
+                self._view_filter = (key, value)
             else:
                 self.filter_text = "Filter: All Days"
-                self.view_data = self.all_data[:]
         else:
             self.filter_text = "Filter: Off"
-            self.view_data = self.all_data[:]
             self.info_text = ""
 
+        if self.virtual:
+            _, self.sort_text = self._sql_order()
+            self._reset_window()
+            return
+
+        positions = self.table.positions()
+        if self._view_filter is not None:
+            key, value = self._view_filter
+            positions = self.table.filter(positions, key, value) if key in self.table.columns else array('q')
+        column = self._sort_column()
+        sort_key, self.sort_text = self._sort_key()
+        if column is not None:
+            self.view = self.table.sort(positions, column)
+        else:
+            self.view = self.table.sort_by(positions, sort_key)
+
+    def row_count(self) -> int:
+        return self._view_count if self.virtual else len(self.view)
+
+    def total_count(self) -> int:
+        return self._total_count if self.virtual else len(self.table)
+
+    def row_at(self, index: int) -> dict[str, Any]:
+        if not self.virtual:
+            return self.table.row(self.view[index])
+        return self.rows(index, index + 1)[0]
+
+    def rows(self, start: int, stop: int) -> list[dict[str, Any]]:
+        """
+        in virtual mode inside an event loop, the rows not paged in yet are placeholders (see row_ready)
+        """
+        if not self.virtual:
+            return self.table.rows(self.view[start:stop])
+        if not _in_event_loop():
+            self._ensure_window(start, stop)
+            return self._window[start - self._window_start : stop - self._window_start]
+        stop = min(stop, self._view_count)
+        self._request_window(start, stop)
+        ws = self._window_start
+        return [
+            self._window[i - ws] if ws <= i < ws + len(self._window) else self._placeholder()
+            for i in range(start, stop)
+        ]
+
+    def row_ready(self, index: int) -> bool:
+        """
+        False for a placeholder row of the virtual view, its page is still being read
+        """
+        if not self.virtual or not _in_event_loop():
+            return True
+        ws = self._window_start
+        return not self._window_stale and ws <= index < ws + len(self._window)
+
+    def _placeholder(self) -> dict[str, Any]:
+        row: dict[str, Any] = dict.fromkeys(self.headers, "…")
+        row[self.config.prikey_field] = None
+        return row
+
+    def _sql_where(self) -> dict[str, Any]:
+        if self._view_filter is None:
+            return {}
+        key, value = self._view_filter
+        return {key: value}
+
+    def _sql_order(self) -> tuple[list[str], str]:
+        """
+        ORDER BY of the virtual view, ending with the primary key so that every page key is unique
+        """
         pf = self.config.prikey_field
+        make_order = self.config.sql_sort_keys.get(self.sort_enabled)
+        if self.sort_enabled == 0 or make_order is None:
+            if self.sort_enabled != 0:
+                self.info_text = f"Virtual mode: no SQL for sort {self.sort_enabled}, use default"
+            return [pf], self.config.sort_texts.get(0, "Sort: Default")
+        return make_order(self.db_headers) + [pf], self.config.sort_texts.get(self.sort_enabled, f"Sort: {self.sort_enabled}")
+
+    def _reset_window(self, *, keep_rows: bool = False):
+        """
+        the virtual view changed: count it again and page it again; inside an event loop that is
+        done by a task, meanwhile the old rows still show if keep_rows (only their values changed),
+        placeholders otherwise
+        """
+        self._window_gen += 1
+        if _in_event_loop():
+            self._counts_stale = True
+            if keep_rows:
+                self._window_stale = True
+            else:
+                self._clear_window()
+            self._request_window(*self._window_want)
+            return
+        self._clear_window()
+        self._view_count, self._total_count = self.adb.call(self._counts_db, self._sql_where())
+
+    def _clear_window(self):
+        self._window = []
+        self._window_keys = []
+        self._window_start = 0
+        self._window_stale = False
+
+    def _counts_db(self, db: Dataset, where: dict[str, Any]) -> tuple[int, int]:
+        # on the database thread: the row counts of the view and of the table
+        view_count = db.count(where)
+        return view_count, db.count() if where else view_count
+
+    def _plan_window(self, start: int, stop: int) -> tuple[str, Any, int] | None:
+        """
+        the page that makes the window cover view rows [start, stop): scrolling it by key when
+        the range is next to the current window, jumping by OFFSET otherwise; None if covered
+        """
+        stop = min(stop, self._view_count)
+        if start >= stop:
+            return None
+        ws = self._window_start
+        we = ws + len(self._window)
+        if self._window_stale or not self._window:
+            new_start = max(0, start - self.prefetch)
+            return "offset", new_start, stop - new_start + self.prefetch
+        if ws <= start and stop <= we:
+            return None
+        if ws <= start <= we:
+            return "after", self._window_keys[-1], stop - we + self.prefetch
+        if start < ws <= stop:
+            return "before", self._window_keys[0], ws - start + self.prefetch
+        new_start = max(0, start - self.prefetch)
+        return "offset", new_start, stop - new_start + self.prefetch
+
+    def _page_db(self, db: Dataset, where: dict[str, Any], order_by: list[str], plan: tuple[str, Any, int]) -> list[tuple[dict[str, Any], tuple]]:
+        # on the database thread: the rows of the planned page, with their generated fields
+        kind, at, limit = plan
+        if kind == "after":
+            page = db.dquery_page(where, order_by, after=at, limit=limit)
+        elif kind == "before":
+            page = db.dquery_page(where, order_by, before=at, limit=limit)
+        else:
+            page = db.dquery_page(where, order_by, offset=at, limit=limit)
+        self._generate([row for row, _ in page])
+        return page
+
+    def _ensure_window(self, start: int, stop: int):
+        plan = self._plan_window(start, stop)
+        if plan is None:
+            return
+        order_by, _ = self._sql_order()
+        page = self.adb.call(self._page_db, self._sql_where(), order_by, plan)
+        self._apply_page(plan, page, start, stop)
+
+    def _request_window(self, start: int, stop: int):
+        # in the event loop: have the task page [start, stop) in, unless it already tried
+        self._window_want = (start, stop)
+        if self._window_task is not None:
+            return
+        if not self._counts_stale and (self._window_gen, start, stop) == self._window_tried:
+            return
+        if not self._counts_stale and self._plan_window(start, stop) is None:
+            return
+        self._window_task = asyncio.get_running_loop().create_task(self._fetch_window())
 
+    async def _fetch_window(self):
+        # the task of _request_window: counts and pages on the database thread, until the wanted rows are in
+        try:
+            while True:
+                gen = self._window_gen
+                where = self._sql_where()
+                if self._counts_stale:
+                    counts = await self.adb.run(self._counts_db, where)
+                    if gen != self._window_gen:
+                        continue
+                    self._view_count, self._total_count = counts
+                    self._counts_stale = False
+                start, stop = self._window_want
+                plan = self._plan_window(start, stop)
+                self._window_tried = (gen, start, stop)
+                if plan is None:
+                    break
+                order_by, _ = self._sql_order()
+                page = await self.adb.run(self._page_db, where, order_by, plan)
+                if gen != self._window_gen:
+                    continue
+                if plan[0] == "offset":
+                    self._clear_window()
+                self._apply_page(plan, page, start, stop)
+                if self._window_want == (start, stop):
+                    break
+        except Exception as e:
+            logger.error("virtual view: %s", e)
+        finally:
+            self._window_task = None
+        if self.on_change is not None:
+            self.on_change()
+
+    async def window_ready(self):
+        """
+        wait until the virtual view is counted and paged in after a change
+        """
+        while self._window_task is not None:
+            await asyncio.shield(self._window_task)
+
+    def _apply_page(self, plan: tuple[str, Any, int], page: list[tuple[dict[str, Any], tuple]], start: int, stop: int):
+        kind, at, _ = plan
+        if kind == "after":
+            self._window.extend(row for row, _ in page)
+            self._window_keys.extend(key for _, key in page)
+        elif kind == "before":
+            self._window[:0] = [row for row, _ in page]
+            self._window_keys[:0] = [key for _, key in page]
+            self._window_start -= len(page)
+        else:
+            self._window = [row for row, _ in page]
+            self._window_keys = [key for _, key in page]
+            self._window_start = at
+
+        # keep only `prefetch` rows on both sides of the asked range
+        lo = max(0, start - self._window_start - self.prefetch)
+        hi = stop - self._window_start + self.prefetch
+        if lo > 0 or hi < len(self._window):
+            self._window = self._window[lo:hi]
+            self._window_keys = self._window_keys[lo:hi]
+            self._window_start += lo
+
+    def _sort_key(self) -> tuple[Callable[[dict[str, Any]], Any], str]:
+        pf = self.config.prikey_field
         if self.sort_enabled == 0:
             if self.config.default_sort_key:
-                self.view_data.sort(key=self.config.default_sort_key)
+                sort_key = self.config.default_sort_key
             else:
-                self.view_data.sort(key=lambda r: self.config.prikey_type(r[pf]))
-            self.sort_text = self.config.sort_texts.get(0, "Sort: Default")
+                sort_key = lambda r: self.config.prikey_type(r[pf])
+            return sort_key, self.config.sort_texts.get(0, "Sort: Default")
+        sk = self.config.sort_keys.get(self.sort_enabled)
+        if sk:
+            return sk, self.config.sort_texts.get(self.sort_enabled, f"Sort: {self.sort_enabled}")
+        # fallback
+        return (lambda r: self.config.prikey_type(r[pf])), "Sort: Default"
+
+    def _sort_column(self) -> str | None:
+        column = self.config.sort_columns.get(self.sort_enabled)
+        if column is None or column not in self.table.columns:
+            return None
+        if self.sort_enabled != 0 and self.sort_enabled not in self.config.sort_keys:
+            # _sort_key falls back to the primary key
+            return None
+        return column
+
+    def _in_view(self, row: dict[str, Any]) -> bool:
+        if self._view_filter is None:
+            return True
+        key, value = self._view_filter
+        return str(row.get(key, '')) == str(value)
+
+    def _generate(self, rows: list[dict[str, Any]]):
+        for g in self.config.generated_fields:
+            batch = self.config.batch_generators.get(g)
+            if batch is not None:
+                for row, value in zip(rows, batch(rows)):
+                    row[g] = value
+                continue
+            gen = self.config.generators.get(g)
+            for row in rows:
+                row[g] = "" if gen is None else gen(row)
+
+    def _patch_row(self, old_prikey_value: Any, new_row: dict[str, Any] | None) -> bool:
+        """
+        replace (or remove if `new_row` is None) the row of `old_prikey_value`
+        in the table / view / key map, without reloading the table;
+        return True if it can not and the caller must reload (load_data / load_data_async)
+        """
+        pf = self.config.prikey_field
+        cast = self.config.prikey_type
+
+        if self.virtual:
+            # nothing is cached but the window, page it again
+            self._reset_window(keep_rows=True)
+            return False
+
+        self._drop_cached_row(old_prikey_value)
+        if new_row is None:
+            return False
+        self._generate([new_row])
+        try:
+            new_prikey_value = cast(new_row[pf])
+        except Exception:
+            return True
+        # the insert may have updated a row of the same key (upsert)
+        self._drop_cached_row(new_prikey_value)
+        pos = self.table.append(new_row)
+        self._pos_by_key[new_prikey_value] = pos
+
+        if not self._in_view(new_row):
+            return False
+        # binary search behind the equal keys, the same place a stable sort puts it
+        column = self._sort_column()
+        if column is not None:
+            col = self.table.columns[column]
+            key_at: Callable[[int], Any] = col.__getitem__
         else:
-            sk = self.config.sort_keys.get(self.sort_enabled)
-            if sk:
-                self.view_data.sort(key=sk)
-                self.sort_text = self.config.sort_texts.get(self.sort_enabled, f"Sort: {self.sort_enabled}")
+            sort_key, _ = self._sort_key()
+            key_at = lambda p: sort_key(self.table.row(p))
+        new_key = key_at(pos)
+        lo, hi = 0, len(self.view)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if new_key < key_at(self.view[mid]):
+                hi = mid
             else:
-                # fallback
-                self.view_data.sort(key=lambda r: self.config.prikey_type(r[pf]))
-                self.sort_text = "Sort: Default"
+                lo = mid + 1
+        self.view.insert(lo, pos)
+        return False
 
     def prikey_exists(self, prikey_value: Any) -> bool:
         try:
-            return self.config.prikey_type(prikey_value) in self._cached_key_set
+            prikey_value = self.config.prikey_type(prikey_value)
+        except Exception:
+            return False
+        if self.virtual:
+            return self.adb.call(self._prikey_exists_db, prikey_value)
+        return prikey_value in self._pos_by_key
+
+    async def prikey_exists_async(self, prikey_value: Any) -> bool:
+        """
+        like prikey_exists, in virtual mode the database is asked on its own thread
+        """
+        try:
+            prikey_value = self.config.prikey_type(prikey_value)
         except Exception:
             return False
+        if self.virtual:
+            return await self.adb.run(self._prikey_exists_db, prikey_value)
+        return prikey_value in self._pos_by_key
+
+    def _prikey_exists_db(self, db: Dataset, prikey_value: Any) -> bool:
+        return db.count({self.config.prikey_field: prikey_value}) > 0
 
     def get_next_insert_prikey(self, current_prikey: Any) -> Any:
         current_prikey = self.config.prikey_type(current_prikey)
-        if self.sort_enabled == 0 and (current_prikey + 1) not in self._key_set():
+        if self.sort_enabled == 0 and not self.prikey_exists(current_prikey + 1):
             return current_prikey + 1
         return self._next_bottom_key()
 
+    async def get_next_insert_prikey_async(self, current_prikey: Any) -> Any:
+        if not self.virtual:
+            return self.get_next_insert_prikey(current_prikey)
+        if current_prikey is not None:
+            current_prikey = self.config.prikey_type(current_prikey)
+            if self.sort_enabled == 0 and not await self.prikey_exists_async(current_prikey + 1):
+                return current_prikey + 1
+        return self._bottom_key_after(await self.adb.run(self._max_key_db))
+
+    def view_has_prikey(self, prikey_value: Any) -> bool:
+        if self.virtual:
+            return self._find_view_row_index_by_prikey(prikey_value) is not None
+        row = self._row_by_key(prikey_value)
+        return row is not None and self._in_view(row)
+
     def create_blank_row(self, new_prikey: Any) -> dict[str, Any]:
         headers_without_generated = [h for h in self.headers if h not in self.config.generated_fields]
         if self.config.make_blank:
@@ -250,34 +957,95 @@ class AppState:
 
     def _rebuild_caches(self):
         self.header_to_index = {h: i for i, h in enumerate(self.headers)}
-        pf = self.config.prikey_field
         cast = self.config.prikey_type
-        s: set[Any] = set()
-        for r in self.all_data:
-            try:
-                s.add(cast(r[pf]))
-            except Exception:
-                pass
-        self._cached_key_set = s
-
-    def _key_set(self) -> set[Any]:
-        return self._cached_key_set
+        col = self.table.columns.get(self.config.prikey_field)
+        positions = self.table.positions()
+        if isinstance(col, array) and cast is int:
+            # the usual INTEGER PRIMARY KEY, already sorted if the rows came in rowid order
+            self._pos_by_key = KeyIndex.from_arrays(array('q', (col[pos] for pos in positions)), positions)
+            return
+        pairs: list[tuple[Any, int]] = []
+        if col is not None:
+            for pos in positions:
+                try:
+                    pairs.append((cast(col[pos]), pos))
+                except Exception:
+                    continue
+        self._pos_by_key = KeyIndex(pairs)
+
+    def _row_by_key(self, prikey_value: Any) -> dict[str, Any] | None:
+        # a copy of the loaded row, None in virtual mode
+        pos = None if self.virtual else self._pos_by_key.get(prikey_value)
+        return None if pos is None else self.table.row(pos)
+
+    def _drop_cached_row(self, prikey_value: Any):
+        pos = self._pos_by_key.pop(prikey_value, None)
+        if pos is None:
+            return
+        self.table.remove(pos)
+        try:
+            self.view.remove(pos)
+        except ValueError:
+            pass
 
     def _next_bottom_key(self) -> Any:
         # TODO: 假设 key 可比较且可 +1，暂不更改
-        keys = sorted(self._cached_key_set)
-        return (keys[-1] + 1) if keys else 1
+        if self.virtual:
+            return self._bottom_key_after(self.adb.call(self._max_key_db))
+        return (max(self._pos_by_key) + 1) if self._pos_by_key else 1
+
+    def _bottom_key_after(self, last: Any) -> Any:
+        return (self.config.prikey_type(last) + 1) if last is not None else 1
+
+    def _max_key_db(self, db: Dataset) -> Any:
+        return db.max(self.config.prikey_field)
 
     def _find_view_row_index_by_prikey(self, prikey_value: Any) -> int | None:
-        pf = self.config.prikey_field
-        for i, r in enumerate(self.view_data):
-            try:
-                if self.config.prikey_type(r[pf]) == self.config.prikey_type(prikey_value):
-                    return i
-            except Exception:
-                continue
+        if self.virtual:
+            return self.adb.call(self._view_index_db, self._sql_where(), self._sql_order()[0], prikey_value)
+        try:
+            pos = self._pos_by_key.get(self.config.prikey_type(prikey_value))
+        except Exception:
+            return None
+        if pos is None:
+            return None
+        try:
+            return self.view.index(pos)
+        except ValueError:
+            return None
+
+    def loaded_row_index(self, prikey_value: Any) -> int | None:
+        """
+        the view index of the row, without asking the database: in virtual mode only
+        if it is paged in (for the on_shown callbacks, which run before the write)
+        """
+        if not self.virtual:
+            return self._find_view_row_index_by_prikey(prikey_value)
+        for i, row in enumerate(self._window):
+            if self._prikey_of(row) == prikey_value:
+                return self._window_start + i
         return None
 
+    async def find_view_row_index_async(self, prikey_value: Any) -> int | None:
+        """
+        like _find_view_row_index_by_prikey, in virtual mode the database is asked on its own thread
+        """
+        if not self.virtual:
+            return self._find_view_row_index_by_prikey(prikey_value)
+        await self.window_ready()
+        return await self.adb.run(self._view_index_db, self._sql_where(), self._sql_order()[0], prikey_value)
+
+    def _view_index_db(self, db: Dataset, where: dict[str, Any], order_by: list[str], prikey_value: Any) -> int | None:
+        # on the database thread: how many rows of the view come before the row
+        try:
+            prikey_value = self.config.prikey_type(prikey_value)
+        except Exception:
+            return None
+        page = db.lquery_page({**where, self.config.prikey_field: prikey_value}, order_by, limit=1)
+        if not page:
+            return None
+        return db.count(where, order_by=order_by, before=page[0][-len(order_by):])
+
     def _strip_generated(self, d: dict[str, Any]) -> dict[str, Any]:
         d = dict(d)
         for g in self.config.generated_fields:
@@ -321,8 +1089,8 @@ class TableApp:
         self.state = state
         self.date_text = ""
         self.logging_text = ""
-        self.buffers: list[list[Buffer]] = []
-        self._update_buffers()
+        # only the cell being edited has a real Buffer, the others are plain text
+        self.edit_buffer: Buffer | None = None
         self.kb = KeyBindings()
         self._setup_key_bindings()
         self.app = Application(Layout(Window(height=1)))
@@ -354,16 +1122,8 @@ class TableApp:
         ]
         self.app.style = Style(style_list)
         self._pending_delete: bool = False
-
-    def _update_buffers(self):
-        self.buffers = []
-        for row_data in self.state.view_data:
-            row_buffers = []
-            for header in self.state.headers:
-                buf = Buffer()
-                buf.text = str(row_data[header])
-                row_buffers.append(buf)
-            self.buffers.append(row_buffers)
+        # virtual mode: redraw when the rows paged in on the database thread arrive
+        self.state.on_change = self._update_layout
 
     def _visible_headers(self) -> list[str]:
         pf = self.state.config.prikey_field
@@ -390,36 +1150,36 @@ class TableApp:
                 FormattedTextControl(f"{h}"), style="class:header", height=1, ignore_content_width=True
             ) for h in visible_headers
         ], padding=1, padding_style="class:header.border"))
-        if not self.buffers:
+        row_count = self.state.row_count()
+        if not row_count:
             layouts.append(Window(FormattedTextControl(" --- No data available --- ")))
             return layouts
         height, width = self.app.output.get_size()
         visible_rows_count = height - self.height_remain_for_other
-        self.state.top_row_index = max(0, min(self.state.top_row_index, len(self.buffers) - 1))
-        visible_buffers = self.buffers[self.state.top_row_index : self.state.top_row_index + visible_rows_count]
-        for i, row_buffers in enumerate(visible_buffers):
+        self.state.top_row_index = max(0, min(self.state.top_row_index, row_count - 1))
+        visible_rows = self.state.rows(self.state.top_row_index, self.state.top_row_index + visible_rows_count)
+        for i, row_data in enumerate(visible_rows):
             current_row_index = self.state.top_row_index + i
             is_selected_row = (current_row_index == self.state.selected_row_index)
             cell_windows = []
             for visible_j, header in enumerate(visible_headers):
                 real_j = self.state.headers.index(header)
-                buf = row_buffers[real_j]
                 is_selected_cell = is_selected_row and (real_j == self.state.selected_col_index)
                 style = "class:cell"
                 if self.state.is_editing and is_selected_cell:
                     style = "class:cell.editing"
                 elif is_selected_cell:
                     style = "class:cell.selected"
-                if self.state.is_editing and is_selected_cell:
+                if self.state.is_editing and is_selected_cell and self.edit_buffer is not None:
                     cell_windows.append(Window(
-                        content=BufferControl(buffer=buf, focusable=True),
+                        content=BufferControl(buffer=self.edit_buffer, focusable=True),
                         style=style,
                         height=1,
                         ignore_content_width=True,
                     ))
                 else:
                     cell_windows.append(Window(
-                        content=FormattedTextControl(text=buf.text),
+                        content=FormattedTextControl(text=str(row_data[header])),
                         style=style,
                         height=1,
                         ignore_content_width=True,
@@ -428,8 +1188,8 @@ class TableApp:
         return layouts
 
     def _get_status_text(self):
-        total = len(self.state.all_data)
-        showing = len(self.state.view_data)
+        total = self.state.total_count()
+        showing = self.state.row_count()
         filter_data = f" {self.state.filter_text} |" if self.state.has_filter else ""
         visible_headers = self._visible_headers()
         current_header = self.state.headers[self.state.selected_col_index]
@@ -441,7 +1201,14 @@ class TableApp:
             f"{filter_data} {self.state.sort_text} | "
             f"Rows: {showing}/{total} | At ({self.state.selected_row_index}, {visible_col})"
         )
-        right_text = f" {self.date_text} {self.state.info_text} "
+        last = metrics.last
+        latency = f"{last[0]} {last[2] * 1000:.1f}ms | " if last is not None else ""
+        pending = self.state.saving
+        saving = f"saving… ({pending}) | " if pending else ""
+        unsaved = self.state.unsaved_count()
+        if unsaved:
+            saving += f"unsaved {unsaved} | "
+        right_text = f" {saving}{latency}{self.date_text} {self.state.info_text} "
 
         if self.status_bar and self.status_bar.render_info:
             width = self.status_bar.render_info.window_width
@@ -455,7 +1222,8 @@ class TableApp:
             return " [Enter] Save & Exit | [Esc] Cancel Edit "
         else:
             filter_data = " | [f] Filter" if self.state.has_filter else ""
-            return f" [j/k/h/l] Navigate | [Enter] Edit{filter_data} | [s] Sort | [a/o] Add | [d] Delete | [i] ID | [r] Reload | [q] Quit "
+            save = " | [w] Save" if self.state.write_behind is not None else ""
+            return f" [j/k/h/l] Navigate | [Enter] Edit{filter_data} | [s] Sort | [a/o] Add | [d] Delete | [i] ID | [r] Reload{save} | [q] Quit "
 
     def _get_log_text(self):
         return self.logging_text
@@ -474,35 +1242,52 @@ class TableApp:
         self._update_layout()
 
     def _focus_row_by_prikey(self, prikey_value: Any) -> bool:
-        idx = self.state._find_view_row_index_by_prikey(prikey_value)
+        # in virtual mode only among the rows paged in, the database is not asked on the UI thread
+        idx = self.state.loaded_row_index(prikey_value)
+        if idx is None:
+            return False
+        self.state.selected_row_index = idx
+        return True
+
+    async def _focus_row_by_prikey_async(self, prikey_value: Any) -> bool:
+        idx = await self.state.find_view_row_index_async(prikey_value)
         if idx is None:
             return False
         self.state.selected_row_index = idx
         return True
 
     def _get_selected_prikey(self) -> int | None:
-        if not self.state.view_data:
+        if not self.state.row_count():
             return None
         pf = self.state.config.prikey_field
         cast = self.state.config.prikey_type
-        r = self.state.view_data[self.state.selected_row_index]
+        r = self.state.row_at(self.state.selected_row_index)
         try:
             return cast(r[pf])
         except Exception:
             return None
 
     def _get_view_prikey_list(self) -> list[Any]:
+        """
+        keys of the view, in virtual mode only of the rows around the screen
+        """
         pf = self.state.config.prikey_field
         cast = self.state.config.prikey_type
         out = []
-        for r in self.state.view_data:
+        if self.state.virtual:
+            start = max(0, self.state.selected_row_index - self.state.prefetch)
+            values = [r[pf] for r in self.state.rows(start, self.state.selected_row_index + self.state.prefetch)]
+        else:
+            col = self.state.table.columns[pf]
+            values = [col[pos] for pos in self.state.view]
+        for v in values:
             try:
-                out.append(cast(r[pf]))
+                out.append(cast(v))
             except Exception:
                 out.append(None)
         return out
 
-    def _restore_focus_by_prev_visible(
+    async def _restore_focus_by_prev_visible(
         self,
         old_prikey_list: list[Any],
         old_current_prikey: Any | None,
@@ -514,34 +1299,31 @@ class TableApp:
         3) 若下方没有，往上找第一个存在的
         4) 否则为 0
         """
-        if not self.state.view_data:
+        await self.state.window_ready()
+        if not self.state.row_count():
             self.state.selected_row_index = 0
             return
-        if old_current_prikey is not None and self._focus_row_by_prikey(old_current_prikey):
+        if old_current_prikey is not None and await self._focus_row_by_prikey_async(old_current_prikey):
             return
         try:
             pos = old_prikey_list.index(old_current_prikey)
         except ValueError:
             self.state.selected_row_index = 0
             return
-        pf = self.state.config.prikey_field
-        cast = self.state.config.prikey_type
-        new_keys = set()
-        for r in self.state.view_data:
-            try:
-                new_keys.add(cast(r[pf]))
-            except Exception:
-                pass
         for i in range(pos + 1, len(old_prikey_list)):
             k = old_prikey_list[i]
-            if k in new_keys and self._focus_row_by_prikey(k):
+            if k is not None and await self._focus_row_by_prikey_async(k):
                 return
         for i in range(pos - 1, -1, -1):
             k = old_prikey_list[i]
-            if k in new_keys and self._focus_row_by_prikey(k):
+            if k is not None and await self._focus_row_by_prikey_async(k):
                 return
         self.state.selected_row_index = 0
 
+    async def _refocus(self, old_prikey_list: list[Any], old_current_prikey: Any | None):
+        await self._restore_focus_by_prev_visible(old_prikey_list, old_current_prikey)
+        self._adjust_scroll()
+
     def _setup_key_bindings(self):
 
         kb_nav = KeyBindings()
@@ -586,9 +1368,7 @@ class TableApp:
                 keep_prikey = self._get_selected_prikey()
                 self.state.filter_enabled = not self.state.filter_enabled
                 self.state.apply_filter_and_sort()
-                self._update_buffers()
-                self._restore_focus_by_prev_visible(old_prikey_list, keep_prikey)
-                self._adjust_scroll()
+                event.app.create_background_task(self._refocus(old_prikey_list, keep_prikey))
 
         @kb_nav.add("s")
         def _(event):
@@ -597,25 +1377,23 @@ class TableApp:
             keep_prikey = self._get_selected_prikey()
             self.state.sort_enabled = (self.state.sort_enabled + 1) % (len(self.state.config.sort_keys) + 1)
             self.state.apply_filter_and_sort()
-            self._update_buffers()
-            self._restore_focus_by_prev_visible(old_prikey_list, keep_prikey)
-            self._adjust_scroll()
+            event.app.create_background_task(self._refocus(old_prikey_list, keep_prikey))
 
         @kb_nav.add("r")
         def _(event):
             self._cancel_pending_delete()
-            old_prikey_list = self._get_view_prikey_list()
-            keep_prikey = self._get_selected_prikey()
-            self.state.load_data()
-            self._update_buffers()
-            self._restore_focus_by_prev_visible(old_prikey_list, keep_prikey)
-            self._adjust_scroll()
+            event.app.create_background_task(self._reload())
+
+        @kb_nav.add("w")
+        def _(event):
+            self._cancel_pending_delete()
+            event.app.create_background_task(self._save())
 
         @kb_nav.add("a")
         @kb_nav.add("o")
         def _(event):
             self._cancel_pending_delete()
-            self._add_row()
+            event.app.create_background_task(self._add_row())
 
         @kb_nav.add("i")
         def _(event):
@@ -635,7 +1413,7 @@ class TableApp:
         @kb_nav.add("d")
         def _(event):
             if self._pending_delete:
-                self._confirm_delete()
+                event.app.create_background_task(self._confirm_delete())
             else:
                 self._request_delete()
 
@@ -645,7 +1423,7 @@ class TableApp:
         def _(event): self._cancel_editing()
 
         @kb_edit.add("enter")
-        def _(event): self._save_and_stop_editing()
+        def _(event): event.app.create_background_task(self._save_and_stop_editing())
 
         is_editing_filter = Condition(lambda: self.state.is_editing)
         self.kb.bindings.extend(kb_nav.bindings)
@@ -658,7 +1436,7 @@ class TableApp:
 
     def _move_cursor(self, dr, dc):
         new_row = self.state.selected_row_index + dr
-        if 0 <= new_row < len(self.buffers):
+        if 0 <= new_row < self.state.row_count():
             self.state.selected_row_index = new_row
 
         if dc != 0:
@@ -673,26 +1451,51 @@ class TableApp:
 
         self._adjust_scroll()
 
-    def _add_row(self):
+    async def _save(self):
+        try:
+            n = await self.state.flush()
+        except sqlite3.Error as e:
+            self.logging_text = f"Save error: {e} (edits kept)"
+        else:
+            if n:
+                self.logging_text = f"Saved {n} row(s)"
+        self.app.invalidate()
+
+    async def _reload(self):
+        old_prikey_list = self._get_view_prikey_list()
+        keep_prikey = self._get_selected_prikey()
+        self.logging_text = "Reload: loading…"
+        self.app.invalidate()
+        await self.state.load_data_async()
+        await self.state.window_ready()
+        self.logging_text = f"Reload: {self.state.total_count()} rows"
+        await self._refocus(old_prikey_list, keep_prikey)
+
+    async def _add_row(self):
         pf = self.state.config.prikey_field
 
-        if not self.state.view_data:
+        if not self.state.row_count():
             new_prikey = 1
         else:
-            current_prikey = self.state.view_data[self.state.selected_row_index][pf]
-            new_prikey = self.state.get_next_insert_prikey(current_prikey)
+            # None on a placeholder row: at the bottom
+            current_prikey = self.state.row_at(self.state.selected_row_index)[pf]
+            new_prikey = await self.state.get_next_insert_prikey_async(current_prikey)
 
-        if self.state.prikey_exists(new_prikey):
+        if await self.state.prikey_exists_async(new_prikey):
             self.logging_text = f"Add: computed {pf}={new_prikey} already exists (unexpected)."
             self.app.invalidate()
             return
 
+        def shown():
+            self.logging_text = f"Add: {pf}={new_prikey} (saving…)"
+            self._focus_row_by_prikey(new_prikey)
+            self._adjust_scroll()
+
         new_row = self.state.create_blank_row(new_prikey)
-        res = self.state.insert(new_row)
-        self.logging_text = f"Add {res}: {pf}={new_prikey}"
+        res = await self.state.insert_async(new_row, on_shown=shown)
+        self.logging_text = f"Add {res}: {pf}={new_prikey}" if res else (self.state.info_text or "Add: Failed")
 
-        self._update_buffers()
-        self._focus_row_by_prikey(new_prikey)
+        await self._focus_row_by_prikey_async(new_prikey)
         self._adjust_scroll()
 
     def _start_editing(self):
@@ -705,33 +1508,46 @@ class TableApp:
             self.logging_text = f"Edit: '{header}' is not editable."
             self.app.invalidate()
             return
+        if not self.state.row_count():
+            return
+        if not self.state.row_ready(self.state.selected_row_index):
+            self.logging_text = "Edit: the row is still loading."
+            self.app.invalidate()
+            return
         self.state.is_editing = True
-        target_buffer = self.buffers[self.state.selected_row_index][self.state.selected_col_index]
+        self.edit_buffer = Buffer()
+        self.edit_buffer.text = str(self.state.row_at(self.state.selected_row_index)[header])
         self._update_layout()
         for w in self.app.layout.find_all_windows():
-            if isinstance(w.content, BufferControl) and w.content.buffer == target_buffer:
+            if isinstance(w.content, BufferControl) and w.content.buffer == self.edit_buffer:
                 self.app.layout.focus(w)
                 break
 
     def _cancel_editing(self):
-        original_text = str(self.state.view_data[self.state.selected_row_index][self.state.headers[self.state.selected_col_index]])
-        self.buffers[self.state.selected_row_index][self.state.selected_col_index].text = original_text
+        original_text = str(self.state.row_at(self.state.selected_row_index)[self.state.headers[self.state.selected_col_index]])
+        self.edit_buffer = None
         self.state.is_editing = False
         self.logging_text = f"Remain: {original_text}"
-        self._update_buffers()
         self._update_layout()
 
-    def _save_and_stop_editing(self):
+    async def _save_and_stop_editing(self):
         self.state.is_editing = False
 
         row_index = self.state.selected_row_index
         key = self.state.headers[self.state.selected_col_index]
 
         pf = self.state.config.prikey_field
-        stable_old_key = self.state.config.prikey_type(self.state.view_data[row_index][pf])
+        if not self.state.row_ready(row_index):
+            self.edit_buffer = None
+            self.logging_text = "Update: the row was reloaded while editing, canceled"
+            self._update_layout()
+            return
+        row = self.state.row_at(row_index)
+        stable_old_key = self.state.config.prikey_type(row[pf])
 
-        new_text = self.buffers[row_index][self.state.selected_col_index].text
-        old_value = str(self.state.view_data[row_index].get(key, ""))
+        new_text = self.edit_buffer.text if self.edit_buffer is not None else str(row.get(key, ""))
+        old_value = str(row.get(key, ""))
+        self.edit_buffer = None
 
         if str(old_value) == str(new_text):
             self.logging_text = "Update: Not Change"
@@ -744,22 +1560,23 @@ class TableApp:
                 track_key = self.state.config.prikey_type(new_text)
             except ValueError:
                 self.logging_text = "Update: primary key must be an integer."
-                self._update_buffers()
                 self._update_layout()
                 return
 
-        res = self.state.update(stable_old_key, {key: new_text})
+        def shown():
+            self.logging_text = f"Update: {key} {old_value} > {new_text} (saving…)"
+            self._focus_row_by_prikey(track_key)
+            self._adjust_scroll()
+
+        res = await self.state.update_async(stable_old_key, {key: new_text}, on_shown=shown)
         if not res:
             self.logging_text = self.state.info_text or "Update: Failed"
-            self._update_buffers()
             self._update_layout()
             return
 
-        self._update_buffers()
-
-        found = self._focus_row_by_prikey(track_key)
+        found = await self._focus_row_by_prikey_async(track_key)
         if not found:
-            self.state.selected_row_index = min(self.state.selected_row_index, max(0, len(self.state.view_data) - 1))
+            self.state.selected_row_index = min(self.state.selected_row_index, max(0, self.state.row_count() - 1))
             self.logging_text = f"Update {res}: {key} {old_value} > {new_text} (row not visible due to filter?)"
         else:
             self.logging_text = f"Update {res}: {key} {old_value} > {new_text}"
@@ -767,24 +1584,33 @@ class TableApp:
         self._adjust_scroll()
 
     def _request_delete(self):
-        if not self.state.view_data:
+        if not self.state.row_count() or not self.state.row_ready(self.state.selected_row_index):
             return
-        row = self.state.view_data[self.state.selected_row_index]
+        row = self.state.row_at(self.state.selected_row_index)
         self._pending_delete = True
         pf = self.state.config.prikey_field
         self.logging_text = f"Delete? {pf}={row[pf]} (press 'd' again to confirm, Esc or other operation to cancel)"
         self.app.invalidate()
 
-    def _confirm_delete(self):
+    async def _confirm_delete(self):
         if not self._pending_delete:
             return
         self._pending_delete = False
-        row = self.state.view_data[self.state.selected_row_index]
-        res = self.state.delete(row)
+        if not self.state.row_ready(self.state.selected_row_index):
+            self.logging_text = "Delete: the row is still loading, canceled"
+            self.app.invalidate()
+            return
+        row = self.state.row_at(self.state.selected_row_index)
         pf = self.state.config.prikey_field
-        self.logging_text = f"Delete {res}: {pf}={row[pf]}"
-        self._update_buffers()
-        self.state.selected_row_index = min(self.state.selected_row_index, max(0, len(self.state.view_data) - 1))
+
+        def shown():
+            self.logging_text = f"Delete: {pf}={row[pf]} (saving…)"
+            self.state.selected_row_index = min(self.state.selected_row_index, max(0, self.state.row_count() - 1))
+            self._adjust_scroll()
+
+        res = await self.state.delete_async(row, on_shown=shown)
+        self.logging_text = f"Delete {res}: {pf}={row[pf]}" if res else (self.state.info_text or "Delete: Failed")
+        self.state.selected_row_index = min(self.state.selected_row_index, max(0, self.state.row_count() - 1))
         self._adjust_scroll()
 
     def _cancel_pending_delete(self):
@@ -793,8 +1619,27 @@ class TableApp:
             self.logging_text = "Delete: canceled"
             self.app.invalidate()
 
+    async def _sync(self):
+        if self.state.is_editing:
+            # not under the cell being edited
+            return
+        try:
+            n = await self.state.pull_changes()
+        except Exception as e:
+            logger.error("sync: %s", e)
+            return
+        if n:
+            self.logging_text = f"Synced {n} change(s)"
+            self.state.selected_row_index = min(self.state.selected_row_index, max(0, self.state.row_count() - 1))
+            self._adjust_scroll()
+            self.app.invalidate()
+
     async def _background_updater(self):
         while True:
+            if self.state.write_behind is not None and self.state.write_behind.idle():
+                self.app.create_background_task(self._save())
+            # another cli.py / json-to-table.py may have written the table
+            await self._sync()
             self.date_text = datetime.datetime.now().strftime("%H:%M:%S")
             self.app.invalidate()
             await asyncio.sleep(1)
@@ -803,16 +1648,37 @@ class TableApp:
         update_task = asyncio.create_task(self._background_updater())
         await self.app.run_async()
         update_task.cancel()
+        # the writes still held or queued are done before leaving
+        await self.state.flush()
+        self.state.adb.close(wait=True)
+        if self.state.write_behind is not None:
+            self.state.write_behind.close()
 
 
 if __name__ == "__main__":
 
     db_file = "game.db"
 
-    if len(sys.argv) != 2:
-        table_name = "genshin_materials"
-    else:
-        table_name = sys.argv[1]
+    parser = argparse.ArgumentParser()
+    parser.add_argument("table_name", nargs="?", default="genshin_materials")
+    parser.add_argument("--virtual", action="store_true", help="page rows from the database instead of loading the whole table")
+    parser.add_argument("--profile", choices=list(PROFILES), default="interactive", help="connection tuning, read-only to view next to another editor")
+    parser.add_argument("--write-behind", type=float, metavar="SECONDS", help="hold cell edits, write them together after SECONDS idle, on [w] or on quit")
+    parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], default="ERROR")
+    parser.add_argument("--log-json", metavar="FILE", help="also write the log records, with op/table/rows/duration, as JSON lines")
+    parser.add_argument("--stats-file", metavar="FILE", help="dump the query latency stats to FILE every 10 seconds")
+    parser.add_argument("--trace", action="store_true", help="count SQL statements and VM steps in the stats")
+    args = parser.parse_args()
+
+    logger.setLevel(getattr(logging, args.log_level))
+    if args.log_json:
+        add_json_file(args.log_json)
+    # the UI thread only queues the records, they are written on the listener thread
+    start_queue_logging()
+    metrics.set_tracing(args.trace)
+    if args.stats_file:
+        metrics.start_dump(args.stats_file)
+    table_name = args.table_name
 
     create_scheme = None
     create_data = None
@@ -829,7 +1695,14 @@ if __name__ == "__main__":
     app_state = AppState(
         db_file, table_name,
         create_scheme=create_scheme,
-        create_data=create_data
+        create_data=create_data,
+        virtual=args.virtual,
+        profile=args.profile,
+        write_behind=args.write_behind,
     )
     app_ui = TableApp(app_state)
-    asyncio.run(app_ui.run())
+    try:
+        asyncio.run(app_ui.run())
+    finally:
+        metrics.stop_dump()
+        stop_queue_logging()
@@ -0,0 +1,263 @@
+import sys
+from array import array
+from bisect import bisect_left
+from itertools import compress
+from typing import Any, Callable, Iterable, Iterator, Sequence
+
+
+# int64, like the INTEGER columns of sqlite
+_INT64_MIN, _INT64_MAX = -(1 << 63), (1 << 63) - 1
+
+
+def _is_int(value: Any) -> bool:
+    return type(value) is int and _INT64_MIN <= value <= _INT64_MAX
+
+
+class TupleColumn:
+    """
+    a column of one NamedTuple type of numbers (like craft.Eqv), one array per field
+    """
+
+    def __init__(self, cls: type, sample: tuple):
+        self.cls = cls
+        self.fields = [array('q' if type(v) is int else 'd') for v in sample]
+
+    @staticmethod
+    def fits(value: Any) -> bool:
+        return isinstance(value, tuple) and hasattr(value, "_fields") and all(type(v) in (int, float) for v in value)
+
+    def __len__(self) -> int:
+        return len(self.fields[0])
+
+    def __getitem__(self, pos: int) -> tuple:
+        return self.cls(*(f[pos] for f in self.fields))
+
+    def extend(self, values: Sequence[Any]):
+        size = len(self)
+        try:
+            for value in values:
+                if type(value) is not self.cls:
+                    raise TypeError(f"not a {self.cls.__name__}: {value!r}")
+            for i, f in enumerate(self.fields):
+                f.extend([value[i] for value in values])
+        except (TypeError, OverflowError):
+            self.truncate(size)
+            raise
+
+    def truncate(self, size: int):
+        for f in self.fields:
+            del f[size:]
+
+    def tolist(self) -> list:
+        return [self.cls(*values) for values in zip(*self.fields)]
+
+
+class ColumnTable:
+    """
+    rows kept by column instead of one dict per row: integer columns in array('q'),
+    NamedTuples of numbers in one array per field, strings interned (the repeated country / path
+    names are one object), other values in lists; a row is a position, removed rows leave a hole
+    that is never reused (reload to compact); a view is an array of positions
+    """
+
+    def __init__(self, headers: list[str]):
+        self.headers = list(headers)
+        # starts as array('q'), at the first value that does not fit it becomes
+        # a TupleColumn (if it is empty and the value fits one) or a list
+        self.columns: dict[str, array | TupleColumn | list] = {h: array('q') for h in self.headers}
+        self.alive = bytearray()
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def positions(self) -> array:
+        if self.count == len(self.alive):
+            return array('q', range(self.count))
+        return array('q', compress(range(len(self.alive)), self.alive))
+
+    def _to_list(self, h: str) -> list:
+        col = self.columns[h]
+        if not isinstance(col, list):
+            col = self.columns[h] = col.tolist()
+        return col
+
+    def _extend_column(self, h: str, values: Sequence[Any]):
+        col = self.columns[h]
+        if not isinstance(col, list):
+            size = len(col)
+            if size == 0 and isinstance(col, array) and values and TupleColumn.fits(values[0]):
+                col = self.columns[h] = TupleColumn(type(values[0]), values[0])
+            try:
+                col.extend(values)
+                return
+            except (TypeError, OverflowError):
+                # array.extend() keeps what it took before the failing value
+                if isinstance(col, array):
+                    del col[size:]
+                col = self._to_list(h)
+        try:
+            col.extend(map(sys.intern, values))
+        except TypeError:
+            # not all strings
+            del col[len(self.alive):]
+            col.extend(sys.intern(v) if type(v) is str else v for v in values)
+
+    def append(self, row: dict[str, Any]) -> int:
+        """
+        add a row (missing headers are None), return its position
+        """
+        self.extend_columns({h: [row.get(h)] for h in self.headers}, 1)
+        return len(self.alive) - 1
+
+    def extend(self, rows: Iterable[dict[str, Any]]):
+        """
+        like append for every row
+        """
+        rows = list(rows)
+        self.extend_columns({h: [row.get(h) for row in rows] for h in self.headers}, len(rows))
+
+    def extend_columns(self, values: dict[str, Sequence[Any]], n: int):
+        """
+        add n rows given as {header: n values}, missing headers are None
+        """
+        if not n:
+            return
+        for h in self.headers:
+            column_values = values.get(h)
+            self._extend_column(h, [None] * n if column_values is None else column_values)
+        self.alive.extend(b"\x01" * n)
+        self.count += n
+
+    def remove(self, pos: int):
+        if not self.alive[pos]:
+            return
+        self.alive[pos] = 0
+        self.count -= 1
+        # let go of what the hole holds, the numbers cost nothing
+        for col in self.columns.values():
+            if isinstance(col, list):
+                col[pos] = None
+
+    def get(self, pos: int, h: str) -> Any:
+        return self.columns[h][pos]
+
+    def row(self, pos: int) -> dict[str, Any]:
+        """
+        a new dict of the row, changing it does not change the table
+        """
+        return {h: col[pos] for h, col in self.columns.items()}
+
+    def rows(self, positions: Iterable[int]) -> list[dict[str, Any]]:
+        cols = list(self.columns.items())
+        return [{h: col[pos] for h, col in cols} for pos in positions]
+
+    def filter(self, positions: Iterable[int], h: str, value: Any) -> array:
+        """
+        the positions whose `h` reads as `value` (compared as text, like the cell shows it)
+        """
+        col = self.columns[h]
+        if isinstance(col, array) and _is_int(value):
+            return array('q', (pos for pos in positions if col[pos] == value))
+        text = str(value)
+        return array('q', (pos for pos in positions if str(col[pos]) == text))
+
+    def sort(self, positions: Iterable[int], h: str) -> array:
+        """
+        the positions ordered by column `h`, stable
+        """
+        col = self.columns[h]
+        if isinstance(col, TupleColumn) and col.cls.__lt__ is tuple.__lt__:
+            # plain tuples of the fields order the same, without building a NamedTuple per row
+            keys = list(zip(*col.fields))
+            return array('q', sorted(positions, key=keys.__getitem__))
+        return array('q', sorted(positions, key=col.__getitem__))
+
+    def sort_by(self, positions: Iterable[int], key: Callable[[dict[str, Any]], Any]) -> array:
+        """
+        like sort, with a key of the row dict (slower, every row is built once)
+        """
+        cols = list(self.columns.items())
+        return array('q', sorted(positions, key=lambda pos: key({h: col[pos] for h, col in cols})))
+
+
+class KeyIndex:
+    """
+    key -> position, the int64 keys in two arrays sorted by key (16 bytes a row,
+    a dict spends about 100 on the entry and the two int objects), other keys in a dict
+    """
+
+    def __init__(self, pairs: Iterable[tuple[Any, int]] = ()):
+        ints = []
+        self._other: dict[Any, int] = {}
+        for key, pos in pairs:
+            if _is_int(key):
+                ints.append((key, pos))
+            else:
+                self._other[key] = pos
+        # the last position of a key wins, as in a dict
+        ints.sort(key=lambda kp: kp[0])
+        self._keys = array('q')
+        self._positions = array('q')
+        for key, pos in ints:
+            if self._keys and self._keys[-1] == key:
+                self._positions[-1] = pos
+            else:
+                self._keys.append(key)
+                self._positions.append(pos)
+
+    @classmethod
+    def from_arrays(cls, keys: array, positions: array) -> "KeyIndex":
+        """
+        from int64 keys and their positions, faster than from pairs when the keys come sorted
+        """
+        index = cls()
+        if all(a < b for a, b in zip(keys, keys[1:])):
+            index._keys = array('q', keys)
+            index._positions = array('q', positions)
+            return index
+        return cls(zip(keys, positions))
+
+    def _find(self, key: int) -> int:
+        i = bisect_left(self._keys, key)
+        return i if i < len(self._keys) and self._keys[i] == key else -1
+
+    def __len__(self) -> int:
+        return len(self._keys) + len(self._other)
+
+    def __iter__(self) -> Iterator[Any]:
+        yield from self._keys
+        yield from self._other
+
+    def __contains__(self, key: Any) -> bool:
+        if _is_int(key):
+            return self._find(key) >= 0
+        return key in self._other
+
+    def get(self, key: Any, default: int | None = None) -> int | None:
+        if _is_int(key):
+            i = self._find(key)
+            return self._positions[i] if i >= 0 else default
+        return self._other.get(key, default)
+
+    def __setitem__(self, key: Any, pos: int):
+        if not _is_int(key):
+            self._other[key] = pos
+            return
+        i = bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            self._positions[i] = pos
+        else:
+            self._keys.insert(i, key)
+            self._positions.insert(i, pos)
+
+    def pop(self, key: Any, default: int | None = None) -> int | None:
+        if not _is_int(key):
+            return self._other.pop(key, default)
+        i = self._find(key)
+        if i < 0:
+            return default
+        pos = self._positions[i]
+        del self._keys[i]
+        del self._positions[i]
+        return pos
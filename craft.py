@@ -1,7 +1,21 @@
+import warnings
+from array import array
+from functools import total_ordering
+from typing import Any, NamedTuple, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # optional, only makes batch_eqv faster
+    np = None
+
+
+@total_ordering
 class CraftItem:
 
     CRAFT_CONST = 3
 
+    __slots__ = ("name", "only_eqv", "loots", "_small", "_big")
+
     def __init__(
         self,
         *loots: int | list | tuple,
@@ -9,41 +23,59 @@ class CraftItem:
     ) -> None:
         self.name: str = name
         self.only_eqv = only_eqv
-        self.loots: list[int] = []
-        self.set_loots(*loots)
+        self.loots: tuple[int, ...] = ()
+        self._small: int = 0
+        self._big: float = 0.0
+        self._set_loots(*loots)
 
     def set_loots(self, *loots: int | list | tuple) -> None:
+        """
+        deprecated: changes the hash, a CraftItem already in a set or dict gets lost; make a new one
+        """
+        warnings.warn(
+            "CraftItem.set_loots is deprecated, make a new CraftItem instead",
+            DeprecationWarning, stacklevel=2,
+        )
+        self._set_loots(*loots)
+
+    def _set_loots(self, *loots: int | list | tuple) -> None:
+        # only from __init__: the hash depends on the loots
         if len(loots) == 1 and isinstance(loots[0], (tuple, list)):
-            self.loots = list(loots[0])
+            loots = tuple(loots[0])
             print("Warning: better to make the loots split by ',' instead of passing a tuple or list")
-        else:
-            self.loots = list(loots)  # type: ignore
-        for i, data in enumerate(self.loots):
-            try: int(data)
-            except: self.loots[i] = 0
-
-    def __int__(self) -> int:
-        total = 0
+        self.loots = tuple(to_count(data) for data in loots)
+        # the equivalents are computed once here, not on every int() / float() / comparison
+        small = 0
+        for loot in self.loots:
+            small = small * self.CRAFT_CONST + loot
+        big = 0.0
         multiplier = 1
-        for loot in reversed(self.loots):
-            total += loot * multiplier
+        for loot in self.loots:
+            big += loot / multiplier
             multiplier *= self.CRAFT_CONST
-        return total
+        self._small = small
+        self._big = big
+
+    def __int__(self) -> int:
+        return self._small
 
     def __float__(self) -> float:
-        total = 0
-        multiplier = 1
-        for loot in self.loots:
-            total += loot / multiplier
-            multiplier *= self.CRAFT_CONST
-        return total
+        return self._big
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, CraftItem):
+            return NotImplemented
+        return self._small == other._small
 
     def __lt__(self, other: 'CraftItem') -> bool:
-        return int(self) < int(other)
+        return self._small < other._small
+
+    def __hash__(self) -> int:
+        return hash(self._small)
 
     def __str__(self) -> str:
         if self.only_eqv:
-            return f"{float(self):.2f} ({int(self)})"
+            return f"{self._big:.2f} ({self._small})"
         loot_str = ""
         for loot in self.loots:
             loot_str += f"{loot:>3}, "
@@ -51,5 +83,77 @@ class CraftItem:
         return (
             f"{self.name:<20}\t"
             f"[{loot_str}];\t"
-            f"(Eqv. Big:{float(self):>7.2f}, Small:{int(self):>5})"
+            f"(Eqv. Big:{self._big:>7.2f}, Small:{self._small:>5})"
         )
+
+
+def tier_columns(headers: Sequence[str]) -> list[str]:
+    """
+    the tier count columns among the headers (tier1_count, tier2_count, ...), lowest tier first
+    """
+    return [h for h in headers if h.startswith("tier")]
+
+
+def eqv_sql(columns: list[str], craft_const: int = CraftItem.CRAFT_CONST) -> str:
+    """
+    SQL expression of int(CraftItem) over the tier columns (lowest tier first),
+    to sort or index by it inside the database; non-numbers count as 0 like in CraftItem
+    """
+    result = columns[0]
+    for col in columns[1:]:
+        result = f"({result}) * {craft_const} + {col}"
+    return f"({result})"
+
+
+class Eqv(NamedTuple):
+    """
+    the equivalents of one row as given by batch_eqv, prints like CraftItem(only_eqv=True)
+    """
+    big: float
+    small: int
+
+    def __int__(self) -> int:
+        return self.small
+
+    def __float__(self) -> float:
+        return self.big
+
+    def __str__(self) -> str:
+        return f"{self.big:.2f} ({self.small})"
+
+
+def to_count(value: Any) -> int:
+    """
+    non-numbers count as 0, like the loots of CraftItem
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def batch_eqv(
+    tiers: Sequence[Sequence[int]] | Any,
+    craft_const: int = CraftItem.CRAFT_CONST,
+) -> tuple[Any, Any]:
+    """
+    float(CraftItem) and int(CraftItem) of many rows at once;
+    tiers: one column of counts per tier (lowest tier first), each column holding all rows,
+           e.g. a list of array.array('q'), or a numpy array of shape (tiers, rows);
+    return (big, small): numpy float64 / int64 arrays when numpy is installed,
+           array.array('d') / array.array('q') otherwise
+    """
+    if len(tiers) == 0:
+        return array('d'), array('q')
+    n = len(tiers)
+    if np is not None:
+        matrix = np.asarray(tiers, dtype=np.int64)
+        weights = craft_const ** np.arange(n - 1, -1, -1, dtype=np.int64)
+        small = weights @ matrix
+        return small / float(craft_const ** (n - 1)), small
+    # Horner over the columns, one C-level zip per tier
+    small_list = list(tiers[0])
+    for column in tiers[1:]:
+        small_list = [s * craft_const + c for s, c in zip(small_list, column)]
+    scale = float(craft_const ** (n - 1))
+    return array('d', [s / scale for s in small_list]), array('q', small_list)
@@ -1,8 +1,49 @@
+import os
+import sys
+import time
+import atexit
+import asyncio
 import sqlite3
-from typing import Any
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import OrderedDict
+from typing import Any, Callable, Iterator, TypeVar
 from enum import Enum, auto
 
-from logger import logger # type: ignore
+from logger import logger, log_op # type: ignore
+from metrics import metrics, PROGRESS_STEPS
+
+
+T = TypeVar("T")
+
+
+# rows per fetchmany() of the iter_* queries
+DEFAULT_CHUNK_SIZE = 1000
+# store_many() of at least this many rows refreshes the planner statistics
+ANALYZE_AFTER_ROWS = 1000
+# statement texts kept per connection, sqlite3 keeps as many prepared statements (cached_statements)
+STATEMENT_CACHE_SIZE = 256
+# row changes of the tables whose Scheme tracks changes, written by triggers
+CHANGELOG_TABLE = "_changelog"
+# the changelog keeps at least this many latest changes, readers further behind reload everything
+CHANGELOG_KEEP = 10000
+# bound parameters per `IN (...)` query
+IN_CHUNK_SIZE = 500
+# INSERT ... ON CONFLICT DO UPDATE without a conflict target and RETURNING, older ones get INSERT OR REPLACE
+HAS_UPSERT = sqlite3.sqlite_version_info >= (3, 35, 0)
+# rows of query results kept per connection by Dataset(cache=True)
+RESULT_CACHE_ROWS = 10000
+# and at most about this many bytes of them (sys.getsizeof of the rows and values), long TEXT / BLOB rows count more
+RESULT_CACHE_BYTES = 16 << 20
+
+
+def _done(op: str, table: str, msg: str, *args, rows: int | None = None, start: float):
+    # time the operation into metrics, then log it
+    duration = time.perf_counter() - start
+    metrics.record(op, table, duration, rows)
+    log_op(op, table, msg, *args, rows=rows, duration=duration, stacklevel=2)
 
 
 class VALUE(Enum):
@@ -97,11 +138,43 @@ class Constrain:
             raise NotImplementedError(f"{self.constrain_type} is not implement")
 
 
+class Index:
+    def __init__(
+        self,
+        *columns: str,
+        name: str | None = None,
+        unique: bool = False,
+        where: str | None = None,
+    ):
+        """
+        columns: column names or expressions, add ` DESC` yourself if you need
+        name: default to the columns joined by `_`, the table name is always prefixed
+        where: make it a partial index
+        """
+        self.columns = list(columns)
+        self.name = name or "_".join(c.split()[0] for c in columns)
+        self.unique = unique
+        self.where = where
+
+    def full_name(self, table_name: str) -> str:
+        return f"idx_{table_name}_{self.name}"
+
+    def sql(self, table_name: str) -> str:
+        result = "CREATE UNIQUE INDEX" if self.unique else "CREATE INDEX"
+        result += f" IF NOT EXISTS {self.full_name(table_name)} ON {table_name} ({', '.join(self.columns)})"
+        if self.where is not None:
+            result += f" WHERE {self.where}"
+        return result
+
+
 class Scheme():
 
     def __init__(self):
         self.column_list: list[Column] = []
         self.constrain_list: list[Constrain] = []
+        self.index_list: list[Index] = []
+        self.changelog = False
+        self.natural_key: tuple[str, ...] = ()
 
     def add_column(self, column: Column):
         self.column_list.append(column)
@@ -115,6 +188,31 @@ class Scheme():
     def add_constrains(self, constrains: list[Constrain]):
         self.constrain_list.extend(constrains)
 
+    def add_index(self, index: Index):
+        self.index_list.append(index)
+
+    def add_indexes(self, indexes: list[Index]):
+        self.index_list.extend(indexes)
+
+    def set_natural_key(self, *columns: str):
+        """
+        columns that tell rows apart besides the primary key, json-to-table.py --merge matches on them
+        """
+        self.natural_key = columns
+
+    def primary_key(self) -> str | None:
+        for col in self.column_list:
+            if col.primary:
+                return col.name
+        return None
+
+    def track_changes(self, on: bool = True):
+        """
+        log the key of every inserted / updated / deleted row in the changelog table,
+        see Dataset.changes_since
+        """
+        self.changelog = on
+
     def rename_column(self, old_name: str, new_name: str) -> bool:
         for col in self.column_list:
             if col.name == old_name:
@@ -142,6 +240,372 @@ class Scheme():
         return result[:-1] + "\n)"
 
 
+class Profile:
+    """
+    how a connection is opened and tuned: PRAGMAs run in order after connecting
+    """
+
+    def __init__(self, name: str, pragmas: dict[str, Any] | None = None, *, read_only: bool = False):
+        self.name = name
+        self.pragmas = pragmas or {}
+        self.read_only = read_only
+
+    def connect(self, db_name: str) -> sqlite3.Connection:
+        # only the owner thread uses it, `check_same_thread` is off so that close() works at exit
+        if self.read_only:
+            uri = Path(os.path.abspath(db_name)).as_uri() + "?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+        else:
+            conn = sqlite3.connect(db_name, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+        for pragma, value in self.pragmas.items():
+            row = conn.execute(f"PRAGMA {pragma} = {value}").fetchone()
+            # journal_mode answers the mode it got, it stays as it was if the change is not allowed now
+            if pragma == "journal_mode" and row is not None and str(row[0]).lower() != str(value).lower():
+                logger.warning("[%s]: profile %s wants journal_mode %s, still %s", db_name, self.name, value, row[0])
+        return conn
+
+
+PROFILES: dict[str, Profile] = {
+    # sqlite defaults: rollback journal, synchronous FULL, small page cache, no mmap
+    "default": Profile("default"),
+    # the editor: readers are not blocked by the writer, commit without waiting for fsync of every page
+    "interactive": Profile("interactive", {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -64 * 1024,  # KiB
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    }),
+    # imports that can be redone from the backup: no journal, no fsync
+    # (a crash or a ROLLBACK in the middle may leave the table broken)
+    "bulk-load": Profile("bulk-load", {
+        "journal_mode": "OFF",
+        "synchronous": "OFF",
+        "cache_size": -256 * 1024,
+        "temp_store": "MEMORY",
+        "locking_mode": "EXCLUSIVE",
+    }),
+    # viewers next to one writer, best with a database already in WAL mode
+    "read-only": Profile("read-only", {
+        "query_only": "ON",
+        "cache_size": -64 * 1024,
+        "mmap_size": 256 * 1024 * 1024,
+        "busy_timeout": 5000,
+    }, read_only=True),
+}
+
+
+def get_profile(profile: "str | Profile") -> Profile:
+    if isinstance(profile, Profile):
+        return profile
+    try:
+        return PROFILES[profile]
+    except KeyError:
+        raise ValueError(f"unknown profile {profile!r}, expect one of {', '.join(PROFILES)}") from None
+
+
+class StatementCache:
+    """
+    LRU of SQL texts keyed by (operation, table, columns...), no bigger than the prepared statement
+    cache of sqlite3, so a text found here is also still prepared there
+    """
+
+    def __init__(self, size: int = STATEMENT_CACHE_SIZE):
+        self.size = size
+        self._texts: OrderedDict[tuple, str] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple, build: Callable[[], str]) -> str:
+        text = self._texts.get(key)
+        if text is not None:
+            self.hits += 1
+            self._texts.move_to_end(key)
+            return text
+        self.misses += 1
+        text = build()
+        self._texts[key] = text
+        if len(self._texts) > self.size:
+            self._texts.popitem(last=False)
+        return text
+
+    def clear(self):
+        self._texts.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._texts)}
+
+
+def _size_of(result: Any) -> int:
+    # estimated bytes of a cached result: the tuple of rows, the rows, their values
+    size = sys.getsizeof(result)
+    if isinstance(result, tuple):
+        for row in result:
+            size += sys.getsizeof(row)
+            if isinstance(row, tuple):
+                size += sum(map(sys.getsizeof, row))
+    return size
+
+
+class ResultCache:
+    """
+    LRU of query results keyed by (SQL text, parameters), holding at most max_rows rows and
+    about max_bytes bytes; the results of a table are dropped when this connection writes it,
+    all of them when PRAGMA data_version tells another connection committed
+    """
+
+    def __init__(self, max_rows: int = RESULT_CACHE_ROWS, max_bytes: int = RESULT_CACHE_BYTES):
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        # key -> (table, result, rows, bytes)
+        self._results: OrderedDict[tuple, tuple[str, Any, int, int]] = OrderedDict()
+        self._keys_by_table: dict[str, set[tuple]] = {}
+        self.rows = 0
+        self.bytes = 0
+        self.data_version: int | None = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def check_data_version(self, cursor: sqlite3.Cursor):
+        cursor.execute("PRAGMA data_version")
+        version = cursor.fetchone()[0]
+        if version != self.data_version:
+            self.invalidate()
+            self.data_version = version
+
+    def get(self, key: tuple) -> tuple[bool, Any]:
+        entry = self._results.get(key)
+        if entry is None:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        self._results.move_to_end(key)
+        return True, entry[1]
+
+    def put(self, key: tuple, table: str, result: Any, rows: int):
+        if rows > self.max_rows:
+            return
+        size = _size_of(result)
+        if size > self.max_bytes:
+            return
+        self._pop(key)
+        self._results[key] = (table, result, rows, size)
+        self._keys_by_table.setdefault(table, set()).add(key)
+        self.rows += rows
+        self.bytes += size
+        while self.rows > self.max_rows or self.bytes > self.max_bytes:
+            self._pop(next(iter(self._results)))
+
+    def _pop(self, key: tuple):
+        entry = self._results.pop(key, None)
+        if entry is None:
+            return
+        table, _, rows, size = entry
+        self.rows -= rows
+        self.bytes -= size
+        keys = self._keys_by_table.get(table)
+        if keys is not None:
+            keys.discard(key)
+
+    def invalidate(self, table_name: str | None = None):
+        if table_name is None:
+            if self._results:
+                self.invalidations += 1
+            self._results.clear()
+            self._keys_by_table.clear()
+            self.rows = 0
+            self.bytes = 0
+            return
+        keys = self._keys_by_table.pop(table_name, None)
+        if keys:
+            self.invalidations += 1
+            for key in keys:
+                _, _, rows, size = self._results.pop(key)
+                self.rows -= rows
+                self.bytes -= size
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "entries": len(self._results),
+            "rows": self.rows,
+            "bytes": self.bytes,
+        }
+
+
+class PooledConnection:
+    """
+    a pooled connection and the caches that are only valid for it
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.schema_version: int | None = None
+        # table_name -> (PRAGMA table_info rows, column names)
+        self.schema: dict[str, tuple[list[tuple], list[str]]] = {}
+        self.statements = StatementCache()
+        self.results = ResultCache()
+        self.tracing = False
+
+    def set_tracing(self, on: bool):
+        """
+        count the statements and VM steps of this connection in metrics
+        """
+        self.conn.set_trace_callback(metrics.on_statement if on else None)
+        self.conn.set_progress_handler(metrics.on_progress if on else None, PROGRESS_STEPS)
+        self.tracing = on
+
+    def check_schema_version(self, cursor: sqlite3.Cursor) -> bool:
+        """
+        drop the schema cache if any connection (maybe in another process) changed the schema,
+        return True if it was dropped
+        """
+        cursor.execute("PRAGMA schema_version")
+        version = cursor.fetchone()[0]
+        if version == self.schema_version:
+            return False
+        self.schema_version = version
+        self.schema.clear()
+        return True
+
+    def invalidate_schema(self, table_name: str | None = None):
+        if table_name is None:
+            self.schema.clear()
+        else:
+            self.schema.pop(table_name, None)
+        # DDL: the results of any table may be off (renamed, dropped, new columns)
+        self.results.invalidate()
+
+
+class ConnectionPool:
+    """
+    process-wide pool, one per database file and profile, one connection per thread;
+    also remember which tables are known to exist
+    """
+
+    _pools: dict[tuple[str, str], "ConnectionPool"] = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, db_name: str, profile: Profile | None = None):
+        self.db_name = db_name
+        self.profile = profile or PROFILES["default"]
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conns: list[PooledConnection] = []
+        self._known_tables: set[str] = set()
+        self._indexed_tables: set[str] = set()
+        # schema_version the known / indexed tables are up to date with
+        self.schema_version: int | None = None
+
+    @classmethod
+    def get(cls, db_name: str, profile: str | Profile = "default") -> "ConnectionPool":
+        profile = get_profile(profile)
+        key = (os.path.abspath(db_name), profile.name)
+        with cls._pools_lock:
+            pool = cls._pools.get(key)
+            if pool is None:
+                pool = cls(db_name, profile)
+                cls._pools[key] = pool
+            return pool
+
+    @classmethod
+    def close_all(cls):
+        with cls._pools_lock:
+            pools = list(cls._pools.values())
+            cls._pools.clear()
+        for pool in pools:
+            pool.close()
+
+    def connection(self) -> PooledConnection:
+        pc: PooledConnection | None = getattr(self._local, "pc", None)
+        if pc is None:
+            pc = PooledConnection(self.profile.connect(self.db_name))
+            self._local.pc = pc
+            with self._lock:
+                self._conns.append(pc)
+            logger.info("[%s]: new %s connection (%d in pool)", self.db_name, self.profile.name, len(self._conns))
+        if pc.tracing != metrics.tracing:
+            pc.set_tracing(metrics.tracing)
+        return pc
+
+    def table_exists(self, cursor: sqlite3.Cursor, table_name: str) -> bool:
+        if table_name in self._known_tables:
+            return True
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,))
+        exists = cursor.fetchone() is not None
+        if exists:
+            self.remember_table(table_name)
+        return exists
+
+    def remember_table(self, table_name: str):
+        with self._lock:
+            self._known_tables.add(table_name)
+
+    def forget_table(self, table_name: str | None = None):
+        with self._lock:
+            if table_name is None:
+                self._known_tables.clear()
+                self._indexed_tables.clear()
+            else:
+                self._known_tables.discard(table_name)
+                self._indexed_tables.discard(table_name)
+
+    def check_schema_version(self, version: int):
+        """
+        forget the known / indexed tables if someone else changed the schema since they were noted;
+        our own DDL keeps them up to date and notes its version (Dataset._note_own_ddl)
+        """
+        with self._lock:
+            if version == self.schema_version:
+                return
+            changed = self.schema_version is not None
+            self.schema_version = version
+        if changed:
+            self.forget_table()
+
+    def is_indexed(self, table_name: str) -> bool:
+        return table_name in self._indexed_tables
+
+    def remember_indexed(self, table_name: str):
+        with self._lock:
+            self._indexed_tables.add(table_name)
+
+    def close(self):
+        with self._lock:
+            conns = self._conns
+            self._conns = []
+            self._known_tables.clear()
+            self._indexed_tables.clear()
+        self._local = threading.local()
+        for pc in conns:
+            try:
+                pc.conn.commit()
+                pc.conn.close()
+            except sqlite3.Error as e:
+                logger.warning("[%s]: close connection failed: %s", self.db_name, e)
+
+
+atexit.register(ConnectionPool.close_all)
+
+
+def table_names(db_name: str) -> list[str]:
+    """
+    user tables of the database, without the ones sqlite keeps for itself and the changelog
+    """
+    conn = ConnectionPool.get(db_name).connection().conn
+    cursor = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' AND name != ? ORDER BY name",
+        (CHANGELOG_TABLE,),
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
 class Dataset:
 
     def __init__(
@@ -149,37 +613,59 @@ class Dataset:
         *,
         create_scheme: Scheme | None = None,
         create_data: list[dict] | None = None,
+        profile: str | Profile = "default",
+        cache: bool = False,
     ):
+        """
+        profile: a name in PROFILES (default, interactive, bulk-load, read-only) or a Profile
+        cache: serve the repeated lookups (lquery_constrain, dquery_constrain, pages, count, max)
+               from the result cache of the connection, see ResultCache; writes made with
+               `self.cursor` directly must call invalidate_results()
+        """
         self.db_name = dataset_name
         self.table_name = table_name
         self.create_scheme = create_scheme
         self.create_data = create_data
+        self.cache = cache
+        self.pool = ConnectionPool.get(dataset_name, profile)
+        self.pc: PooledConnection | None = None
         self.conn: sqlite3.Connection | None = None
         self.cursor: sqlite3.Cursor | None = None
+        self._in_transaction = False
+        self._savepoint_depth = 0
 
     def __enter__(self):
-        self.conn = sqlite3.connect(self.db_name)
+        # borrow the connection of this thread, it is not closed on exit
+        self.pc = self.pool.connection()
+        self.conn = self.pc.conn
         self.cursor = self.conn.cursor()
-        self.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?", (self.table_name,))
-        table_exists = self.cursor.fetchone() is not None
-        if not table_exists:
+        if not self.pool.table_exists(self.cursor, self.table_name):
             if self.create_scheme is None:
                 raise ValueError(f"{self.table_name} is not exist, so create_scheme must be specified")
             self._create_table()
             if self.create_data is not None:
                 self.store_many(self.create_data)
+        if self.create_scheme is not None and not self.pool.profile.read_only and not self.pool.is_indexed(self.table_name):
+            self._create_indexes()
+            if self.create_scheme.changelog:
+                self._create_triggers()
+                self.prune_changes()
         return self
 
     def __exit__(self, exc_type: Any, exc_val: Any, exc_tb: Any):
         if self.conn:
             self.conn.commit()
-            self.conn.close()
+        if self.cursor:
+            self.cursor.close()
+        self.pc = None
+        self.conn = None
+        self.cursor = None
 
     @staticmethod
     def precheck(func):
         def wrapper(self, *args, **kwargs):
             if not self.cursor:
-                logger.warning(f"<{self.table_name}>: cursor is not available")
+                logger.warning("<%s>: cursor is not available", self.table_name)
                 return
             return func(self, *args, **kwargs)
         return wrapper
@@ -189,142 +675,643 @@ class Dataset:
         def deco(func):
             def wrapper(self, *args, **kwargs):
                 if not self.cursor:
-                    logger.warning(f"<{self.table_name}>: cursor is not available")
+                    logger.warning("<%s>: cursor is not available", self.table_name)
                     return return_data
                 return func(self, *args, **kwargs)
             return wrapper
         return deco
 
+    @contextmanager
+    def transaction(self):
+        """
+        run the writes inside as one transaction: committed at the end, rolled back on error;
+        inside another transaction() or savepoint() it is a savepoint instead;
+        writes made before it in the `with Dataset` block are committed first
+        """
+        assert self.conn is not None
+        if self._in_transaction or self._savepoint_depth:
+            with self.savepoint():
+                yield self
+            return
+        if self.conn.in_transaction:
+            self.conn.commit()
+        self.conn.execute("BEGIN")
+        self._in_transaction = True
+        try:
+            yield self
+        except BaseException:
+            self.conn.rollback()
+            raise
+        else:
+            self.conn.commit()
+        finally:
+            self._in_transaction = False
+
+    @contextmanager
+    def savepoint(self, name: str | None = None):
+        """
+        a nestable part of a transaction, rolled back alone on error
+        """
+        assert self.conn is not None
+        self._savepoint_depth += 1
+        name = name or f"sp_{self._savepoint_depth}"
+        self.conn.execute(f"SAVEPOINT {name}")
+        try:
+            yield self
+        except BaseException:
+            self.conn.execute(f"ROLLBACK TO {name}")
+            self.conn.execute(f"RELEASE {name}")
+            raise
+        else:
+            self.conn.execute(f"RELEASE {name}")
+        finally:
+            self._savepoint_depth -= 1
+
+    def commit(self):
+        """
+        make the writes so far durable, e.g. every N rows of a long job;
+        inside transaction() a new transaction goes on
+        """
+        assert self.conn is not None
+        if self._savepoint_depth:
+            raise RuntimeError(f"<{self.table_name}>: can not commit inside a savepoint")
+        self.conn.commit()
+        if self._in_transaction:
+            self.conn.execute("BEGIN")
+
+    def batch(self) -> "Batch":
+        return Batch(self)
+
+    def _invalidate_schema(self, table_name: str | None = None):
+        if self.pc is not None:
+            self.pc.invalidate_schema(table_name or self.table_name)
+            self._note_own_ddl()
+
+    def _note_own_ddl(self):
+        # after our own DDL: the caches were updated for it, only the schema_version moves on
+        assert self.cursor is not None and self.pc is not None
+        self.cursor.execute("PRAGMA schema_version")
+        version = self.cursor.fetchone()[0]
+        self.pc.schema_version = version
+        self.pool.schema_version = version
+
+    def invalidate_results(self, table_name: str | None = None):
+        """
+        drop the cached results of the table (of this Dataset if not given)
+        """
+        if self.pc is not None:
+            self.pc.results.invalidate(table_name or self.table_name)
+
+    def _cached(self, key: tuple, fetch: Callable[[], T], rows: Callable[[T], int] = lambda _: 1) -> T:
+        """
+        the result of fetch() for this key, from the result cache if on; not inside a transaction,
+        a rollback would leave results that never were
+        """
+        assert self.conn is not None and self.cursor is not None
+        if not self.cache or self.pc is None or self.conn.in_transaction:
+            return fetch()
+        results = self.pc.results
+        results.check_data_version(self.cursor)
+        found, result = results.get(key)
+        if found:
+            return result
+        result = fetch()
+        results.put(key, self.table_name, result, rows(result))
+        return result
+
+    def result_stats(self) -> dict[str, Any]:
+        """
+        hits / misses / hit_rate / invalidations / entries / rows / bytes of the result cache of this thread's connection
+        """
+        return self.pool.connection().results.stats()
+
     @precheck
     def _create_table(self):
         assert self.cursor is not None  # just to suppress type error
         self.cursor.execute(f"CREATE TABLE IF NOT EXISTS {self.table_name} {self.create_scheme}")
-        logger.info(f"<{self.table_name}>: create table")
+        self.pool.remember_table(self.table_name)
+        self._note_own_ddl()
+        logger.info("<%s>: create table", self.table_name)
+
+    @precheck
+    def _create_indexes(self):
+        """
+        create the indexes of create_scheme that are missing
+        """
+        assert self.cursor is not None and self.create_scheme is not None
+        self.cursor.execute(f"PRAGMA index_list({self.table_name})")
+        existing = {row[1] for row in self.cursor.fetchall()}
+        for index in self.create_scheme.index_list:
+            if index.full_name(self.table_name) in existing:
+                continue
+            self.cursor.execute(index.sql(self.table_name))
+            logger.info("<%s>: create index %s", self.table_name, index.full_name(self.table_name))
+        self.pool.remember_indexed(self.table_name)
+        self._note_own_ddl()
+
+    @precheck
+    def _rename_indexes(self, old_name: str, new_name: str):
+        """
+        index names are global, so the ones named after the old table must follow it,
+        or a new table of the old name can not create its own
+        """
+        assert self.cursor is not None
+        old_prefix = f"idx_{old_name}_"
+        self.cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ?", (new_name,))
+        for index_name, sql in self.cursor.fetchall():
+            if sql is None or not index_name.startswith(old_prefix):
+                continue
+            new_index_name = f"idx_{new_name}_" + index_name[len(old_prefix):]
+            self.cursor.execute(f"DROP INDEX {index_name}")
+            self.cursor.execute(sql.replace(index_name, new_index_name, 1))
+            logger.info("<%s>: rename index %s > %s", new_name, index_name, new_index_name)
+
+    def _prikey_column(self) -> str:
+        for h in self._schema()[0]:
+            if h[5] == 1:
+                return h[1]
+        return "rowid"
+
+    @precheck
+    def _create_triggers(self):
+        """
+        triggers writing the key of every changed row to the changelog table
+        """
+        assert self.cursor is not None
+        t = self.table_name
+        pk = f'"{self._prikey_column()}"'
+        self.cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {CHANGELOG_TABLE} "
+            "(seq INTEGER PRIMARY KEY, tbl TEXT NOT NULL, op TEXT NOT NULL, key)"
+        )
+        log = f"INSERT INTO {CHANGELOG_TABLE} (tbl, op, key) VALUES ('{t}'"
+        for name, sql in (
+            ("ins", f"AFTER INSERT ON {t} BEGIN {log}, 'I', NEW.{pk}); END"),
+            ("upd", f"AFTER UPDATE ON {t} BEGIN {log}, 'U', NEW.{pk}); END"),
+            # a changed key: the old one is gone
+            ("updkey", f"AFTER UPDATE ON {t} WHEN OLD.{pk} IS NOT NEW.{pk} BEGIN {log}, 'D', OLD.{pk}); END"),
+            ("del", f"AFTER DELETE ON {t} BEGIN {log}, 'D', OLD.{pk}); END"),
+        ):
+            self.cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{t}_{name} {sql}")
+        self._note_own_ddl()
+        logger.info("<%s>: changelog triggers created", t)
+
+    @precheck
+    def _rename_triggers(self, old_name: str, new_name: str):
+        """
+        like _rename_indexes, the changelog triggers also log under the new name
+        """
+        assert self.cursor is not None
+        old_prefix = f"trg_{old_name}_"
+        self.cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ?", (new_name,))
+        for trigger_name, sql in self.cursor.fetchall():
+            if not trigger_name.startswith(old_prefix):
+                continue
+            new_trigger_name = f"trg_{new_name}_" + trigger_name[len(old_prefix):]
+            self.cursor.execute(f"DROP TRIGGER {trigger_name}")
+            self.cursor.execute(sql.replace(trigger_name, new_trigger_name, 1).replace(f"'{old_name}'", f"'{new_name}'"))
+            logger.info("<%s>: rename trigger %s > %s", new_name, trigger_name, new_trigger_name)
+
+    @precheck
+    def _log_reset(self, table_name: str):
+        """
+        the rows of `table_name` are all gone at once (table renamed or dropped), readers must reload
+        """
+        assert self.cursor is not None
+        if self.pool.table_exists(self.cursor, CHANGELOG_TABLE):
+            self.cursor.execute(f"INSERT INTO {CHANGELOG_TABLE} (tbl, op) VALUES (?, 'R')", (table_name,))
+
+    @precheck_return(None)
+    def change_seq(self) -> int | None:
+        """
+        the latest changelog position, None if no table of the database tracks changes
+        """
+        assert self.cursor is not None
+        if not self.pool.table_exists(self.cursor, CHANGELOG_TABLE):
+            return None
+        self.cursor.execute(f"SELECT MAX(seq) FROM {CHANGELOG_TABLE}")
+        return self.cursor.fetchone()[0] or 0
+
+    @precheck_return(None)
+    def changes_since(self, seq: int, limit: int = CHANGELOG_KEEP) -> tuple[int, dict[Any, str]] | None:
+        """
+        (new position, {key: last op 'I' / 'U' / 'D'}) of the rows of this table changed after `seq`;
+        None if the changelog does not go back that far, has more than `limit` changes
+        or the table was replaced, the caller should reload everything then
+        """
+        assert self.cursor is not None
+        if not self.pool.table_exists(self.cursor, CHANGELOG_TABLE):
+            return None
+        self.cursor.execute(f"SELECT MIN(seq), MAX(seq) FROM {CHANGELOG_TABLE}")
+        low, high = self.cursor.fetchone()
+        if high is None or high <= seq:
+            return seq, {}
+        if low > seq + 1 or high - seq > limit:
+            return None
+        self.cursor.execute(
+            f"SELECT op, key FROM {CHANGELOG_TABLE} WHERE seq > ? AND tbl = ? ORDER BY seq", (seq, self.table_name),
+        )
+        changes: dict[Any, str] = {}
+        for op, key in self.cursor.fetchall():
+            if op == "R":
+                return None
+            changes[key] = op
+        return high, changes
+
+    @precheck
+    def prune_changes(self, keep: int = CHANGELOG_KEEP):
+        """
+        drop all but the latest `keep` changelog entries once there are about twice as many,
+        readers further behind get None from changes_since and reload; only the writers call it
+        (on open, store_many, Batch), a reader polling changes_since never writes
+        """
+        assert self.cursor is not None
+        if self.pool.profile.read_only or not self.pool.table_exists(self.cursor, CHANGELOG_TABLE):
+            return
+        self.cursor.execute(f"SELECT MIN(seq), MAX(seq) FROM {CHANGELOG_TABLE}")
+        low, high = self.cursor.fetchone()
+        if high is not None and high - low > 2 * keep:
+            self.cursor.execute(f"DELETE FROM {CHANGELOG_TABLE} WHERE seq <= ?", (high - keep,))
+            logger.info("<%s>: %d changelog entries pruned", self.table_name, self.cursor.rowcount)
+
+    @contextmanager
+    def untracked(self):
+        """
+        for bulk loads that replace the table: the changelog triggers are dropped inside,
+        then the entries of this table are replaced by one reset entry (readers reload)
+        instead of one entry per row
+        """
+        assert self.cursor is not None
+        self.cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ? AND name LIKE ?",
+            (self.table_name, f"trg_{self.table_name}_%"),
+        )
+        triggers = [row[0] for row in self.cursor.fetchall()]
+        for trigger_name in triggers:
+            self.cursor.execute(f"DROP TRIGGER {trigger_name}")
+        self._note_own_ddl()
+        try:
+            yield self
+        finally:
+            if triggers:
+                self._create_triggers()
+                self._log_reset(self.table_name)
+                # the reset entry stays the last one, so seq never goes back
+                self.cursor.execute(
+                    f"DELETE FROM {CHANGELOG_TABLE} WHERE tbl = ? AND seq < (SELECT MAX(seq) FROM {CHANGELOG_TABLE})",
+                    (self.table_name,),
+                )
+
+    @precheck
+    def analyze(self):
+        """
+        refresh the statistics the query planner uses to pick indexes
+        """
+        assert self.cursor is not None
+        start = time.perf_counter()
+        self.cursor.execute(f"ANALYZE {self.table_name}")
+        _done("analyze", self.table_name, "<%s>: analyzed", self.table_name, start=start)
 
     @precheck
     def _add_column(self, column: Column):
         assert self.cursor is not None
         self.cursor.execute(f"ALTER TABLE {self.table_name} ADD COLUMN {column}")
-        logger.info(f"<{self.table_name}>: add column {column}")
+        self._invalidate_schema()
+        logger.info("<%s>: add column %s", self.table_name, column)
 
     @precheck
     def _rename_table(self, new_name: str):
         assert self.cursor is not None
         old_name = self.table_name
         self.cursor.execute(f"ALTER TABLE {old_name} RENAME TO {new_name}")
+        self._rename_indexes(old_name, new_name)
+        self._rename_triggers(old_name, new_name)
+        self._log_reset(old_name)
+        self.pool.forget_table(old_name)
+        self.pool.remember_table(new_name)
+        self._invalidate_schema(old_name)
         self.table_name = new_name
-        logger.info(f"<{self.table_name}>: rename table {old_name} > {new_name}")
+        logger.info("<%s>: rename table %s > %s", self.table_name, old_name, new_name)
 
     @precheck
     def _rename_column(self, old_name: str, new_name: str):
         assert self.cursor is not None
         self.cursor.execute(f"ALTER TABLE {self.table_name} RENAME COLUMN {old_name} TO {new_name}")
-        logger.info(f"<{self.table_name}>: rename column {old_name} > {new_name}")
+        self._invalidate_schema()
+        logger.info("<%s>: rename column %s > %s", self.table_name, old_name, new_name)
 
     @precheck
     def _delete_column(self, col_name: str):
         assert self.cursor is not None
         self.cursor.execute(f"ALTER TABLE {self.table_name} DROP COLUMN {col_name}")
-        logger.info(f"<{self.table_name}>: delete column {col_name}")
+        self._invalidate_schema()
+        logger.info("<%s>: delete column %s", self.table_name, col_name)
 
     @precheck
     def _delete_table(self):
         assert self.cursor is not None
         self.cursor.execute(f"DROP TABLE IF EXISTS {self.table_name}")
-        logger.info(f"<{self.table_name}>: delete table")
+        self._log_reset(self.table_name)
+        self.pool.forget_table(self.table_name)
+        self._invalidate_schema()
+        logger.info("<%s>: delete table", self.table_name)
 
-    @precheck_return([])
-    def head(self) -> list[tuple]:
-        assert self.cursor is not None
+    @precheck_return(([], []))
+    def _schema(self) -> tuple[list[tuple], list[str]]:
+        """
+        (PRAGMA table_info rows, column names), cached on the connection
+        until some DDL or a schema_version change from outside invalidate it
+        """
+        assert self.cursor is not None and self.pc is not None
+        if self.pc.check_schema_version(self.cursor):
+            # tables may also be created or dropped by others
+            self.pool.check_schema_version(self.pc.schema_version)
+        cached = self.pc.schema.get(self.table_name)
+        if cached is not None:
+            return cached
         self.cursor.execute(f"PRAGMA table_info({self.table_name})")
         res = self.cursor.fetchall()
-        logger.info(f"<{self.table_name}>: head queried")
-        return res
+        cached = (res, [i[1] for i in res])
+        if res:
+            self.pc.schema[self.table_name] = cached
+        logger.info("<%s>: head queried", self.table_name)
+        return cached
+
+    def head(self) -> list[tuple]:
+        return list(self._schema()[0])
 
     def head_name(self) -> list[str]:
-        head = []
-        for i in self.head():
-            head.append(i[1])
-        return head
+        return list(self._schema()[1])
+
+    @precheck_return(0)
+    def data_version(self) -> int:
+        """
+        changes only when another connection commits to the database file
+        """
+        assert self.cursor is not None
+        self.cursor.execute("PRAGMA data_version")
+        return self.cursor.fetchone()[0]
 
     @precheck_return([])
     def lquery_constrain(self, constrain_dict: dict) -> list[tuple]:
         assert self.cursor is not None
-        where = " AND ".join([i + " = ?" for i in constrain_dict.keys()])
-        query = f"SELECT * FROM {self.table_name} WHERE {where}"
-        self.cursor.execute(query, tuple(constrain_dict.values()))
-        res = self.cursor.fetchall()
-        logger.info(f"<{self.table_name}>: all queried")
-        return res
+        query = self._select_sql(tuple(constrain_dict.keys()))
+        params = tuple(constrain_dict.values())
+
+        def fetch() -> tuple[tuple, ...]:
+            assert self.cursor is not None
+            start = time.perf_counter()
+            self.cursor.execute(query, params)
+            res = tuple(self.cursor.fetchall())
+            _done("query", self.table_name, "<%s>: queried where %s", self.table_name, constrain_dict, rows=len(res), start=start)
+            return res
+        # cached as a tuple, every caller gets its own list
+        return list(self._cached((query, params), fetch, len))
 
     def dquery_constrain(self, constrain_dict: dict) -> list[dict]:
-        res = self.lquery_constrain(constrain_dict)
-        head = self.head_name()
-        res = [dict(zip(head, row)) for row in res]
+        if self.cache:
+            head = self._schema()[1]
+            return [dict(zip(head, row)) for row in self.lquery_constrain(constrain_dict)]
+        return [dict(row) for row in self.iter_constrain(constrain_dict, as_dict=True)]
+
+    @precheck_return([])
+    def dquery_in(self, column: str, values: list) -> list[dict]:
+        """
+        rows whose `column` is one of `values`, IN_CHUNK_SIZE values per query
+        """
+        assert self.conn is not None
+        res: list[dict] = []
+        for i in range(0, len(values), IN_CHUNK_SIZE):
+            chunk = tuple(values[i : i + IN_CHUNK_SIZE])
+            query = f'SELECT * FROM {self.table_name} WHERE "{column}" IN ({", ".join(["?"] * len(chunk))})'
+            res.extend(dict(row) for row in self._iter_query(query, chunk, True, DEFAULT_CHUNK_SIZE))
         return res
 
     @precheck_return([])
     def lquery_all(self) -> list[tuple]:
         assert self.cursor is not None
+        start = time.perf_counter()
         query = f"SELECT * FROM {self.table_name}"
         self.cursor.execute(query)
         res = self.cursor.fetchall()
-        logger.info(f"<{self.table_name}>: all queried")
+        _done("query", self.table_name, "<%s>: all queried", self.table_name, rows=len(res), start=start)
         return res
 
     def dquery_all(self) -> list[dict]:
-        res = self.lquery_all()
-        head = self.head_name()
-        res = [dict(zip(head, row)) for row in res]
-        return res
+        return [dict(row) for row in self.iter_all(as_dict=True)]
+
+    @precheck_return(iter(()))
+    def iter_constrain(
+        self, constrain_dict: dict,
+        *,
+        as_dict: bool = False, chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ) -> Iterator[tuple | sqlite3.Row]:
+        """
+        like lquery_constrain, but yield rows `chunk_size` at a time, so memory does not grow with the table;
+        as_dict: yield sqlite3.Row (supports row["name"], keys() and dict(row)) instead of tuple;
+        consume it inside the `with` block
+        """
+        assert self.conn is not None
+        query = self._select_sql(tuple(constrain_dict.keys()))
+        return self._iter_query(query, tuple(constrain_dict.values()), as_dict, chunk_size)
+
+    @precheck_return(iter(()))
+    def iter_all(
+        self,
+        *,
+        as_dict: bool = False, chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ) -> Iterator[tuple | sqlite3.Row]:
+        """
+        like lquery_all, see iter_constrain
+        """
+        assert self.conn is not None
+        query = f"SELECT * FROM {self.table_name}"
+        return self._iter_query(query, (), as_dict, chunk_size)
+
+    def _where_sql(
+        self, constrain_dict: dict | None,
+        order_by: list[str] | None = None,
+        after: tuple | None = None, before: tuple | None = None,
+    ) -> tuple[str, tuple]:
+        where: list[str] = []
+        params: list[Any] = []
+        if constrain_dict:
+            where.extend(i + " = ?" for i in constrain_dict.keys())
+            params.extend(constrain_dict.values())
+        for op, key in ((">", after), ("<", before)):
+            if key is None:
+                continue
+            assert order_by is not None and len(order_by) == len(key)
+            where.append(f"({', '.join(order_by)}) {op} ({', '.join(['?'] * len(key))})")
+            params.extend(key)
+        if not where:
+            return "", ()
+        return " WHERE " + " AND ".join(where), tuple(params)
+
+    @precheck_return([])
+    def lquery_page(
+        self, constrain_dict: dict | None, order_by: list[str],
+        *,
+        after: tuple | None = None, before: tuple | None = None,
+        limit: int = DEFAULT_CHUNK_SIZE, offset: int = 0,
+    ) -> list[tuple]:
+        """
+        keyset pagination: at most `limit` rows in `order_by` order (columns or SQL expressions,
+        the last one should be unique, e.g. the primary key), strictly after / before the given key;
+        each row is followed by its own `order_by` values, the key of the next / previous page;
+        `offset` is only for jumping to a place where no key is known
+        """
+        assert self.cursor is not None
+        where, params = self._where_sql(constrain_dict, order_by, after, before)
+        if before is not None:
+            order = ", ".join(f"{o} DESC" for o in order_by)
+        else:
+            order = ", ".join(order_by)
+        query = f"SELECT *, {', '.join(order_by)} FROM {self.table_name}{where} ORDER BY {order} LIMIT ? OFFSET ?"
+        params += (limit, offset)
+
+        def fetch() -> tuple[tuple, ...]:
+            assert self.cursor is not None
+            start = time.perf_counter()
+            self.cursor.execute(query, params)
+            res = self.cursor.fetchall()
+            if before is not None:
+                res.reverse()
+            _done("page", self.table_name, "<%s>: page queried", self.table_name, rows=len(res), start=start)
+            return tuple(res)
+        return list(self._cached((query, params), fetch, len))
+
+    def dquery_page(self, constrain_dict: dict | None, order_by: list[str], **kwargs) -> list[tuple[dict, tuple]]:
+        """
+        like lquery_page, but give (row dict, page key) pairs
+        """
+        res = self.lquery_page(constrain_dict, order_by, **kwargs)
+        head = self._schema()[1]
+        n = len(head)
+        return [(dict(zip(head, row[:n])), row[n:]) for row in res]
+
+    @precheck_return(0)
+    def count(
+        self, constrain_dict: dict | None = None,
+        *,
+        order_by: list[str] | None = None, before: tuple | None = None,
+    ) -> int:
+        """
+        number of rows matching constrain_dict, and (if given) coming before the key in `order_by` order,
+        that is the index of the row of that key
+        """
+        assert self.cursor is not None
+        where, params = self._where_sql(constrain_dict, order_by, before=before)
+        return self._scalar(f"SELECT COUNT(*) FROM {self.table_name}{where}", params)
+
+    @precheck_return(None)
+    def max(self, column: str) -> Any:
+        return self._scalar(f"SELECT MAX({column}) FROM {self.table_name}", ())
+
+    def _scalar(self, query: str, params: tuple) -> Any:
+        def fetch() -> Any:
+            assert self.cursor is not None
+            self.cursor.execute(query, params)
+            return self.cursor.fetchone()[0]
+        return self._cached((query, params), fetch)
+
+    def _iter_query(self, query: str, params: tuple, as_dict: bool, chunk_size: int) -> Iterator[tuple | sqlite3.Row]:
+        assert self.conn is not None
+        # own cursor, so other queries can run while iterating
+        cursor = self.conn.cursor()
+        if as_dict:
+            cursor.row_factory = sqlite3.Row
+        start = time.perf_counter()
+        cursor.execute(query, params)
+        _done("iter", self.table_name, "<%s>: iter queried", self.table_name, start=start)
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
 
     @precheck_return(False)
     def store(self, item: dict) -> bool:
         assert self.cursor is not None
         if not item:
-            logger.warning(f"<{self.table_name}>: store is empty")
+            logger.warning("<%s>: store is empty", self.table_name)
             return True
-        keys = tuple(item.keys())
-        values = tuple(item.values())
-        cols_str = ", ".join(keys)
-        placeholders = ", ".join(["?"] * len(keys))
-        query = f"INSERT OR REPLACE INTO {self.table_name} ({cols_str}) VALUES ({placeholders})"
-        self.cursor.execute(query, values)
-        logger.info(f"<{self.table_name}>: {item} stored")
+        start = time.perf_counter()
+        query = self._store_sql(tuple(item.keys()))
+        self.cursor.execute(query, tuple(item.values()))
+        self.invalidate_results()
+        _done("store", self.table_name, "<%s>: %s stored", self.table_name, item, rows=self.cursor.rowcount, start=start)
         return True
 
+    @precheck_return(None)
+    def upsert(self, item: dict) -> dict | None:
+        """
+        like store, and return the row as stored, None if it was already the same (nothing written)
+        """
+        assert self.cursor is not None
+        if not item:
+            logger.warning("<%s>: store is empty", self.table_name)
+            return None
+        start = time.perf_counter()
+        if not HAS_UPSERT:
+            self.store(item)
+            rows = self.dquery_constrain({"rowid": self.cursor.lastrowid})
+            return rows[0] if rows else None
+        query = self._store_sql(tuple(item.keys()), returning=True)
+        self.cursor.execute(query, tuple(item.values()))
+        self.invalidate_results()
+        row = self.cursor.fetchone()
+        new_row = None if row is None else dict(zip((d[0] for d in self.cursor.description), row))
+        _done("upsert", self.table_name, "<%s>: %s stored", self.table_name, item, rows=0 if row is None else 1, start=start)
+        return new_row
+
     @precheck_return(False)
-    def store_many(self, items: list[dict]) -> bool:
+    def store_many(self, items: list[dict], *, analyze: bool = True) -> bool:
+        """
+        all items are stored with the keys of the first one;
+        analyze: refresh the planner statistics if there are many items,
+                 turn it off when calling repeatedly and call analyze() once at the end
+        """
         assert self.cursor is not None
         if not items:
-            logger.warning(f"<{self.table_name}>: store is empty")
+            logger.warning("<%s>: store is empty", self.table_name)
             return True
+        start = time.perf_counter()
         try:
             keys = tuple(items[0].keys())
         except (IndexError, AttributeError):
-            logger.error(f"<{self.table_name}>: {items = } must be a non-empty list of dictionaries")
+            logger.error("<%s>: items must be a non-empty list of dictionaries, starts with %.80r", self.table_name,
+                         items[:1] if isinstance(items, list) else items)
             return False
-        cols_str = ", ".join(f'"{k}"' for k in keys)
-        placeholders = ", ".join(["?"] * len(keys))
-        query = f"INSERT OR REPLACE INTO {self.table_name} ({cols_str}) VALUES ({placeholders})"
+        query = self._store_sql(keys)
         try:
             values_list = [tuple(item.get(k) for k in keys) for item in items]
         except AttributeError:
-            logger.error(f"<{self.table_name}>: {items = } all elements must be dictionaries.")
+            logger.error("<%s>: all elements of items must be dictionaries, got %s", self.table_name,
+                         next((type(item).__name__ for item in items if not isinstance(item, dict)), None))
             return False
         self.cursor.executemany(query, values_list)
-        logger.info(f"<{self.table_name}>: {len(items)} item(s) stored")
+        self.invalidate_results()
+        # rows really written: the unchanged ones are skipped
+        _done("store_many", self.table_name, "<%s>: %d item(s) stored", self.table_name, len(items), rows=self.cursor.rowcount, start=start)
+        self.prune_changes()
+        if analyze and len(items) >= ANALYZE_AFTER_ROWS:
+            self.analyze()
         return True
 
     def remove(self, delete_dict: dict) -> bool:
         assert self.cursor is not None
         if not delete_dict or len(delete_dict) == 0:
-            logger.warning(f"<{self.table_name}>: won't delete if not specified")
+            logger.warning("<%s>: won't delete if not specified", self.table_name)
             return False
-        where = " AND ".join([i + " = ?" for i in delete_dict.keys()])
-        query = f"DELETE FROM {self.table_name} WHERE {where}"
+        start = time.perf_counter()
+        query = self._remove_sql(tuple(delete_dict.keys()))
         self.cursor.execute(query, tuple(delete_dict.values()))
-        logger.info(f"<{self.table_name}>: {delete_dict} deleted")
+        self.invalidate_results()
+        _done("remove", self.table_name, "<%s>: %s deleted", self.table_name, delete_dict, rows=self.cursor.rowcount, start=start)
         return True
 
     @precheck_return(False)
@@ -332,24 +1319,260 @@ class Dataset:
         assert self.cursor is not None
 
         if not where_dict:
-            logger.warning(f"<{self.table_name}>: won't update if where_dict not specified")
+            logger.warning("<%s>: won't update if where_dict not specified", self.table_name)
             return False
         if not set_dict:
-            logger.warning(f"<{self.table_name}>: won't update if set_dict is empty")
+            logger.warning("<%s>: won't update if set_dict is empty", self.table_name)
             return True
 
-        set_clause = ", ".join([f'"{k}" = ?' for k in set_dict.keys()])
-        where_clause = " AND ".join([f'"{k}" = ?' for k in where_dict.keys()])
-        query = f'UPDATE {self.table_name} SET {set_clause} WHERE {where_clause}'
-
+        start = time.perf_counter()
+        query = self._update_sql(tuple(set_dict.keys()), tuple(where_dict.keys()))
         values = tuple(set_dict.values()) + tuple(where_dict.values())
         self.cursor.execute(query, values)
+        self.invalidate_results()
 
-        logger.info(f"<{self.table_name}>: update {set_dict} where {where_dict}")
+        _done("update", self.table_name, "<%s>: update %s where %s", self.table_name, set_dict, where_dict, rows=self.cursor.rowcount, start=start)
         return True
 
+    def _statement(self, key: tuple, build: Callable[[], str]) -> str:
+        # the same text every time, so sqlite3 reuses the prepared statement too
+        if self.pc is None:
+            return build()
+        return self.pc.statements.get(key, build)
+
+    @staticmethod
+    def stats() -> dict[str, Any]:
+        """
+        latency histograms and row counts per operation, statement counts, see metrics.Metrics
+        """
+        return metrics.stats()
+
+    def statement_stats(self) -> dict[str, int]:
+        """
+        hits / misses / size of the statement text cache of this thread's connection
+        """
+        return self.pool.connection().statements.stats()
+
+    def _select_sql(self, where_keys: tuple) -> str:
+        def build():
+            where = " AND ".join([i + " = ?" for i in where_keys])
+            return f"SELECT * FROM {self.table_name} WHERE {where}"
+        return self._statement(("select", self.table_name, where_keys), build)
+
+    def _store_sql(self, keys: tuple, *, returning: bool = False) -> str:
+        """
+        insert, or on a key conflict update only the given columns and only if one differs
+        (INSERT OR REPLACE would delete the row, reset the other columns and rewrite every index);
+        returning: the written row comes back
+        """
+        if not HAS_UPSERT:
+            def build_replace():
+                cols_str = ", ".join(f'"{k}"' for k in keys)
+                placeholders = ", ".join(["?"] * len(keys))
+                return f"INSERT OR REPLACE INTO {self.table_name} ({cols_str}) VALUES ({placeholders})"
+            return self._statement(("store", self.table_name, keys), build_replace)
+
+        def build():
+            # only on a cache miss: _prikey_column() checks the schema version
+            prikey = self._prikey_column()
+            t = self.table_name
+            cols_str = ", ".join(f'"{k}"' for k in keys)
+            placeholders = ", ".join(["?"] * len(keys))
+            set_keys = [k for k in keys if k != prikey]
+            if set_keys:
+                set_clause = ", ".join(f'"{k}" = excluded."{k}"' for k in set_keys)
+                changed = " OR ".join(f'{t}."{k}" IS NOT excluded."{k}"' for k in set_keys)
+                conflict = f"DO UPDATE SET {set_clause} WHERE {changed}"
+            else:
+                conflict = "DO NOTHING"
+            query = f"INSERT INTO {t} ({cols_str}) VALUES ({placeholders}) ON CONFLICT {conflict}"
+            return query + " RETURNING *" if returning else query
+        return self._statement(("store", self.table_name, keys, returning), build)
+
+    def _update_sql(self, set_keys: tuple, where_keys: tuple) -> str:
+        def build():
+            set_clause = ", ".join([f'"{k}" = ?' for k in set_keys])
+            where_clause = " AND ".join([f'"{k}" = ?' for k in where_keys])
+            return f'UPDATE {self.table_name} SET {set_clause} WHERE {where_clause}'
+        return self._statement(("update", self.table_name, set_keys, where_keys), build)
+
+    def _remove_sql(self, where_keys: tuple) -> str:
+        def build():
+            where = " AND ".join([f'"{k}" = ?' for k in where_keys])
+            return f"DELETE FROM {self.table_name} WHERE {where}"
+        return self._statement(("remove", self.table_name, where_keys), build)
+
     def insert_or_update(self, item: dict) -> bool:
         return self.store(item)
 
     def delete(self, delete_dict: dict) -> bool:
         return self.remove(delete_dict)
+
+
+class Batch:
+    """
+    collect the writes of a Dataset and run them in one transaction,
+    each run of the same statement goes through one executemany();
+    as a context manager it runs on exit (if no error)
+    """
+
+    def __init__(self, db: Dataset):
+        self.db = db
+        self._groups: list[tuple[str, list[tuple]]] = []
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type: Any, exc_val: Any, exc_tb: Any):
+        if exc_type is None:
+            self.execute()
+
+    def _add(self, query: str, values: tuple):
+        # only consecutive ones are grouped, so the order of the writes is kept
+        if self._groups and self._groups[-1][0] == query:
+            self._groups[-1][1].append(values)
+        else:
+            self._groups.append((query, [values]))
+        self.count += 1
+
+    def store(self, item: dict) -> bool:
+        if not item:
+            logger.warning("<%s>: store is empty", self.db.table_name)
+            return True
+        self._add(self.db._store_sql(tuple(item.keys())), tuple(item.values()))
+        return True
+
+    def update_where(self, where_dict: dict, set_dict: dict) -> bool:
+        if not where_dict:
+            logger.warning("<%s>: won't update if where_dict not specified", self.db.table_name)
+            return False
+        if not set_dict:
+            logger.warning("<%s>: won't update if set_dict is empty", self.db.table_name)
+            return True
+        query = self.db._update_sql(tuple(set_dict.keys()), tuple(where_dict.keys()))
+        self._add(query, tuple(set_dict.values()) + tuple(where_dict.values()))
+        return True
+
+    def remove(self, delete_dict: dict) -> bool:
+        if not delete_dict:
+            logger.warning("<%s>: won't delete if not specified", self.db.table_name)
+            return False
+        self._add(self.db._remove_sql(tuple(delete_dict.keys())), tuple(delete_dict.values()))
+        return True
+
+    def execute(self) -> int:
+        """
+        run and clear the collected writes, return how many there were
+        """
+        if not self._groups:
+            return 0
+        assert self.db.cursor is not None
+        start = time.perf_counter()
+        with self.db.transaction():
+            for query, values_list in self._groups:
+                self.db.cursor.executemany(query, values_list)
+            self.db.prune_changes()
+        self.db.invalidate_results()
+        n = self.count
+        _done("batch", self.db.table_name, "<%s>: batch of %d write(s) in %d statement(s)",
+               self.db.table_name, n, len(self._groups), rows=n, start=start)
+        self._groups = []
+        self.count = 0
+        return n
+
+
+class AsyncDataset:
+    """
+    run work on a Dataset in one dedicated thread, so an asyncio event loop never waits on sqlite;
+    the work goes in order, each piece inside its own `with Dataset` (committed when it returns),
+    all on the pooled connection of that thread
+    """
+
+    def __init__(
+        self, dataset_name: str, table_name: str,
+        *,
+        create_scheme: Scheme | None = None,
+        create_data: list[dict] | None = None,
+        profile: str | Profile = "default",
+        cache: bool = False,
+    ):
+        self.db_name = dataset_name
+        self.table_name = table_name
+        self.create_scheme = create_scheme
+        self.create_data = create_data
+        self.profile = profile
+        self.cache = cache
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"db-{table_name}")
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        """
+        work submitted and not finished yet
+        """
+        return self._pending
+
+    def _call(self, func: Callable[..., T], args: tuple, kwargs: dict) -> T:
+        self._thread = threading.current_thread()
+        with Dataset(
+            self.db_name, self.table_name,
+            create_scheme=self.create_scheme, create_data=self.create_data,
+            profile=self.profile, cache=self.cache,
+        ) as db:
+            return func(db, *args, **kwargs)
+
+    def _finished(self, _: Future):
+        with self._lock:
+            self._pending -= 1
+
+    def submit(self, func: Callable[..., T], *args, **kwargs) -> "Future[T]":
+        """
+        func(db, *args, **kwargs) on the database thread
+        """
+        with self._lock:
+            self._pending += 1
+        future = self._executor.submit(self._call, func, args, kwargs)
+        future.add_done_callback(self._finished)
+        return future
+
+    def call(self, func: Callable[..., T], *args, **kwargs) -> T:
+        """
+        like submit, and wait for the result (at once if already on the database thread)
+        """
+        if threading.current_thread() is self._thread:
+            return self._call(func, args, kwargs)
+        return self.submit(func, *args, **kwargs).result()
+
+    async def run(self, func: Callable[..., T], *args, **kwargs) -> T:
+        """
+        like submit, for `await`; cancelling the awaiting task does not cancel the work,
+        a write once submitted is always done
+        """
+        return await asyncio.shield(asyncio.wrap_future(self.submit(func, *args, **kwargs)))
+
+    async def store(self, item: dict) -> bool:
+        return await self.run(Dataset.store, item)
+
+    async def upsert(self, item: dict) -> dict | None:
+        return await self.run(Dataset.upsert, item)
+
+    async def store_many(self, items: list[dict], **kwargs) -> bool:
+        return await self.run(Dataset.store_many, items, **kwargs)
+
+    async def update_where(self, where_dict: dict, set_dict: dict) -> bool:
+        return await self.run(Dataset.update_where, where_dict, set_dict)
+
+    async def remove(self, delete_dict: dict) -> bool:
+        return await self.run(Dataset.remove, delete_dict)
+
+    async def dquery_constrain(self, constrain_dict: dict) -> list[dict]:
+        return await self.run(Dataset.dquery_constrain, constrain_dict)
+
+    async def dquery_all(self) -> list[dict]:
+        return await self.run(Dataset.dquery_all)
+
+    def close(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
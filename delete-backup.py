@@ -11,4 +11,4 @@ if __name__ == "__main__":
     ) as db:
         db._delete_table()
         print(f"{name}_backup table deleted")
-    print(f"TIPS: you can mannually delete {name}_backup.json")
+    print(f"TIPS: you can mannually delete {name}_backup.snap (or {name}_backup.json)")
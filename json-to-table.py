@@ -1,16 +1,167 @@
 import sys
-import json
+import time
+import argparse
 from pathlib import Path
 
 import scheme.genshin, scheme.starrail
-from db import Dataset, Column, VALUE
+from db import Dataset, Column, VALUE, PROFILES
+from logger import logger # type: ignore
+from jsonio import is_json_lines, iter_json_rows, write_json_array
+from snapshot import write_snapshot
 
 
 # example: uv run json-to-table.py genshin_weapon
+#          uv run json-to-table.py genshin_weapon.jsonl --batch-size 5000 --commit-every 100000
+#          uv run json-to-table.py genshin_weapon --profile bulk-load
+#          uv run json-to-table.py genshin_weapon --merge --delete-missing
+#          uv run json-to-table.py genshin_weapon --merge --key id
+
+
+def store_stream(db: Dataset, rows, batch_size: int, commit_every: int) -> int:
+    """
+    store rows with store_many() in batches of the same keys, in one transaction
+    committed every commit_every rows (if given); return the number of rows
+    """
+    n = 0
+    uncommitted = 0
+    batch: list[dict] = []
+    keys: tuple = ()
+
+    def flush():
+        nonlocal batch
+        if batch:
+            db.store_many(batch, analyze=False)
+            batch = []
+
+    start = time.perf_counter()
+    with db.transaction():
+        for row in rows:
+            row_keys = tuple(row.keys())
+            # store_many takes the keys of the first item, other keys must start a new batch
+            if row_keys != keys or len(batch) >= batch_size:
+                flush()
+                keys = row_keys
+            batch.append(row)
+            n += 1
+            uncommitted += 1
+            if commit_every and uncommitted >= commit_every:
+                flush()
+                db.commit()
+                uncommitted = 0
+                elapsed = time.perf_counter() - start
+                print(f"  {n} rows, {n / elapsed:.0f} rows/s")
+        flush()
+    return n
+
+
+def merge_stream(db: Dataset, rows, key: tuple[str, ...], prikey: str | None, delete_missing: bool, batch_size: int) -> dict[str, int]:
+    """
+    match rows with the table: on the primary key when the row has a known one, else on `key`;
+    update only the changed columns, insert the new rows, delete the rows no longer there
+    if delete_missing; all in one transaction, return the counts
+    {"updated", "inserted", "deleted", "unchanged", "skipped"}
+
+    the natural key is not unique (rows added in the TUI all get the same empty one),
+    a natural key that matches more than one row of the table or of the file is skipped
+    """
+    summary = dict.fromkeys(("updated", "inserted", "deleted", "unchanged", "skipped"), 0)
+    by_id: dict = {}
+    by_key: dict[tuple, list[dict]] = {}
+    for row in db.iter_all(as_dict=True):
+        row = dict(row)
+        if prikey is not None:
+            by_id[row[prikey]] = row
+        by_key.setdefault(tuple(row[k] for k in key), []).append(row)
+    match_on_key = key != (prikey,)
+    # rows to match on the natural key, after every row with an id has taken its own
+    pending: dict[tuple, list[dict]] = {}
+    claimed: set = set()
+
+    def update(old: dict, row: dict):
+        changed = {k: v for k, v in row.items() if k != prikey and old.get(k) != v}
+        if not changed:
+            summary["unchanged"] += 1
+            return
+        if prikey is not None:
+            batch.update_where({prikey: old[prikey]}, changed)
+        else:
+            batch.update_where({k: old[k] for k in key}, changed)
+        summary["updated"] += 1
+
+    def insert(row: dict):
+        batch.store(row)
+        summary["inserted"] += 1
+
+    with db.transaction(), db.batch() as batch:
+        for row in rows:
+            if prikey is not None and row.get(prikey) in by_id:
+                if row[prikey] in claimed:
+                    logger.warning("<%s>: %s = %r is in the file twice, skipped: %.80r", db.table_name, prikey, row[prikey], row)
+                    summary["skipped"] += 1
+                else:
+                    claimed.add(row[prikey])
+                    update(by_id[row[prikey]], row)
+            elif not match_on_key:
+                # no id yet, or an unknown one: a new row
+                insert(row)
+            elif any(k not in row for k in key):
+                logger.warning("<%s>: row without %s skipped: %.80r", db.table_name, key, row)
+                summary["skipped"] += 1
+            else:
+                pending.setdefault(tuple(row[k] for k in key), []).append(row)
+            if batch.count >= batch_size:
+                batch.execute()
+
+        for row_key, new_rows in pending.items():
+            olds = [old for old in by_key.get(row_key, ()) if prikey is None or old[prikey] not in claimed]
+            if len(new_rows) > 1 or len(olds) > 1:
+                logger.warning("<%s>: %s = %r is on %d row(s) of the file and %d of the table, skipped",
+                               db.table_name, key, row_key, len(new_rows), len(olds))
+                summary["skipped"] += len(new_rows)
+                # neither deleted: which one is which is not known
+                claimed.update(old[prikey] for old in olds if prikey is not None)
+                continue
+            if olds:
+                if prikey is not None:
+                    claimed.add(olds[0][prikey])
+                # matched on the natural key: the row keeps its id
+                update(olds[0], {k: v for k, v in new_rows[0].items() if k != prikey})
+            else:
+                insert(new_rows[0])
+            if batch.count >= batch_size:
+                batch.execute()
+
+        if delete_missing:
+            if prikey is not None:
+                for row_id in by_id.keys() - claimed:
+                    batch.remove({prikey: row_id})
+                    summary["deleted"] += 1
+            else:
+                for row_key in by_key.keys() - pending.keys():
+                    batch.remove(dict(zip(key, row_key)))
+                    summary["deleted"] += len(by_key[row_key])
+    return summary
+
 
 if __name__ == "__main__":
-    name = sys.argv[1]
-    name_with_json = Path(name) if name.endswith(".json") else Path(f"{name}.json")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("name", help="table name, or the .json / .jsonl file named after it")
+    parser.add_argument("--batch-size", type=int, default=1000, help="rows per executemany")
+    parser.add_argument("--commit-every", type=int, default=0, help="commit every N rows, 0 for one transaction")
+    parser.add_argument("--profile", choices=list(PROFILES), default="default", help="bulk-load: no journal and no fsync, restore the backup if it fails")
+    parser.add_argument("--json-backup", action="store_true", help="back up to <name>_backup.json instead of a snapshot")
+    parser.add_argument("--merge", action="store_true", help="write only the differences into the table instead of replacing it")
+    parser.add_argument("--key", nargs="+", metavar="COLUMN", help="--merge: columns to match rows without a known id on (default: the scheme's natural key, else the primary key)")
+    parser.add_argument("--delete-missing", action="store_true", help="--merge: delete the rows not in the file")
+    args = parser.parse_args()
+
+    name: str = args.name
+    if name.endswith((".json", ".jsonl", ".ndjson")):
+        name_with_json = Path(name)
+    elif not Path(f"{name}.json").exists() and Path(f"{name}.jsonl").exists():
+        name_with_json = Path(f"{name}.jsonl")
+    else:
+        name_with_json = Path(f"{name}.json")
     table_name = name_with_json.stem
 
     if not name_with_json.exists():
@@ -30,32 +181,57 @@ if __name__ == "__main__":
         print(f"cannot find proper scheme for table {table_name}")
         exit(1)
 
-    with open(name_with_json,'r') as f:
-        table_new_data = json.loads(f.read())
-        print(f"{name_with_json} read")
-
     backup = table_name + "_backup"
+    if args.merge:
+        prikey = create_scheme.primary_key()
+        key = tuple(args.key or create_scheme.natural_key or (prikey,))
+        with Dataset(
+            "game.db", table_name,
+            create_scheme=create_scheme,
+            create_data=create_data,
+            profile=args.profile,
+        ) as db, open(name_with_json, 'r') as f:
+            # the table stays, the backup is only to go back
+            if args.json_backup:
+                with open(f"{backup}.json",'w') as f_backup:
+                    write_json_array(f_backup, (dict(row) for row in db.iter_all(as_dict=True)))
+                print(f"{table_name} table data backup to {backup}.json")
+            else:
+                write_snapshot(db, f"{backup}.snap")
+                print(f"{table_name} table data backup to {backup}.snap")
+            start = time.perf_counter()
+            rows = iter_json_rows(f, is_json_lines(name_with_json) or None)
+            summary = merge_stream(db, rows, key, prikey, args.delete_missing, args.batch_size)
+            elapsed = time.perf_counter() - start
+            print(f"{name_with_json} merged into {table_name} on {', '.join(key)} in {elapsed:.2f}s: "
+                  + ", ".join(f"{n} {what}" for what, n in summary.items()))
+        sys.exit(0)
+
     with Dataset(
         "game.db", table_name,
+        profile=args.profile,
     ) as db:
-        dq = db.dquery_all()
-        with open(f"{backup}.json",'w') as f:
-            f.write(json.dumps(dq, ensure_ascii=False))
+        if args.json_backup:
+            with open(f"{backup}.json",'w') as f:
+                write_json_array(f, (dict(row) for row in db.iter_all(as_dict=True)))
             print(f"{table_name} table data backup to {backup}.json and rename to {backup}")
+        else:
+            write_snapshot(db, f"{backup}.snap")
+            print(f"{table_name} table data backup to {backup}.snap and rename to {backup}")
         db._rename_table(backup)
 
     with Dataset(
         "game.db", table_name,
         create_scheme=create_scheme,
         create_data=create_data,
-    ) as db:
+        profile=args.profile,
+    ) as db, open(name_with_json, 'r') as f:
         print(db.head_name())
-        for data in table_new_data:
-            # may_have = db.dquery_constrain({
-            #     "country": data["country"],
-            #     "open_day": data["open_day"]
-            # })
-            # if len(may_have) == 1:
-            #     data["id"] = may_have[0]["id"]
-            db.store(data)
-        print(f"data stored in {table_name}")
+        start = time.perf_counter()
+        rows = iter_json_rows(f, is_json_lines(name_with_json) or None)
+        # the whole table is new: one reset entry in the changelog, not one per row
+        with db.untracked():
+            n = store_stream(db, rows, args.batch_size, args.commit_every)
+        db.analyze()
+        elapsed = time.perf_counter() - start
+        print(f"{name_with_json} read, {n} rows stored in {table_name} in {elapsed:.2f}s ({n / max(elapsed, 1e-9):.0f} rows/s)")
@@ -0,0 +1,151 @@
+import re
+import gzip
+import json
+from itertools import islice
+from pathlib import Path
+from typing import Any, IO, Iterable, Iterator
+
+
+# characters read from the file at a time when parsing a JSON array
+READ_SIZE = 1 << 16
+# rows joined into one write() when writing
+WRITE_ROWS = 1000
+
+_WHITESPACE = re.compile(r"\s*")
+
+
+def is_json_lines(path: Path) -> bool:
+    suffixes = path.suffixes
+    if suffixes and suffixes[-1] == ".gz":
+        suffixes = suffixes[:-1]
+    return bool(suffixes) and suffixes[-1] in (".jsonl", ".ndjson")
+
+
+def open_json(path: Path, mode: str = "r") -> IO[str]:
+    """
+    open as text, through gzip if the name ends with .gz
+    """
+    if path.suffix == ".gz":
+        return gzip.open(path, mode + "t", encoding="utf-8")  # type: ignore
+    return open(path, mode)
+
+
+def iter_json_rows(f: IO[str], json_lines: bool | None = None) -> Iterator[dict]:
+    """
+    yield the objects of a JSON array (`[{...}, {...}]`) or of JSON Lines (one object per line)
+    one by one, without reading the whole file;
+    json_lines: None to guess from the first character
+    """
+    if json_lines is None:
+        first = f.read(1)
+        while first.isspace():
+            first = f.read(1)
+        json_lines = first != "["
+        if json_lines:
+            yield from _iter_lines(f, first)
+        else:
+            yield from _iter_array(f, first)
+    elif json_lines:
+        yield from _iter_lines(f, "")
+    else:
+        yield from _iter_array(f, "")
+
+
+def _iter_lines(f: IO[str], head: str) -> Iterator[dict]:
+    first_line = head + f.readline() if head else None
+    if first_line is not None and first_line.strip():
+        yield _as_row(json.loads(first_line))
+    for line in f:
+        if line.strip():
+            yield _as_row(json.loads(line))
+
+
+def _iter_array(f: IO[str], head: str) -> Iterator[dict]:
+    decoder = json.JSONDecoder()
+    buf = head
+    pos = 0
+    eof = False
+
+    def skip_whitespace() -> bool:
+        # move pos to the next token, reading more if needed; False at the end of file
+        nonlocal buf, pos, eof
+        while True:
+            pos = _WHITESPACE.match(buf, pos).end()  # type: ignore
+            if pos < len(buf):
+                return True
+            if eof:
+                return False
+            buf = f.read(READ_SIZE)
+            pos = 0
+            eof = not buf
+
+    if not skip_whitespace() or buf[pos] != "[":
+        raise ValueError("JSON array must start with '['")
+    pos += 1
+    while skip_whitespace():
+        if buf[pos] == "]":
+            return
+        if buf[pos] == ",":
+            pos += 1
+            continue
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            # the object is cut by the end of the buffer
+            if eof:
+                raise
+            chunk = f.read(READ_SIZE)
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+        yield _as_row(obj)
+        pos = end
+        # keep the buffer from growing with the file
+        if pos > READ_SIZE:
+            buf = buf[pos:]
+            pos = 0
+    raise ValueError("JSON array is not closed by ']'")
+
+
+def _as_row(obj: Any) -> dict:
+    if not isinstance(obj, dict):
+        raise ValueError(f"each row must be a JSON object, got {type(obj).__name__}")
+    return obj
+
+
+def _chunks(rows: Iterable[dict]) -> Iterator[list[str]]:
+    it = iter(rows)
+    while True:
+        chunk = [json.dumps(row, ensure_ascii=False) for row in islice(it, WRITE_ROWS)]
+        if not chunk:
+            return
+        yield chunk
+
+
+def write_json_array(f: IO[str], rows: Iterable[dict]) -> int:
+    """
+    same text as json.dumps(list(rows), ensure_ascii=False), WRITE_ROWS rows in memory at a time;
+    return the number of rows
+    """
+    n = 0
+    f.write("[")
+    for chunk in _chunks(rows):
+        if n:
+            f.write(", ")
+        f.write(", ".join(chunk))
+        n += len(chunk)
+    f.write("]")
+    return n
+
+
+def write_json_lines(f: IO[str], rows: Iterable[dict]) -> int:
+    """
+    one JSON object per line; return the number of rows
+    """
+    n = 0
+    for chunk in _chunks(rows):
+        f.write("\n".join(chunk))
+        f.write("\n")
+        n += len(chunk)
+    return n
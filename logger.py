@@ -1,7 +1,14 @@
 import sys
+import json
+import time
+import queue
 import logging
+import logging.handlers
 import colorlog
 
+# fields of the records from log_op(), for handlers that want them apart from the message
+STRUCTURED_FIELDS = ("op", "table", "rows", "duration")
+
 def setup_logger(level=logging.ERROR):
 
     logger = logging.getLogger()
@@ -34,3 +41,87 @@ def setup_logger(level=logging.ERROR):
     return logger
 
 logger = setup_logger()
+
+
+def log_op(
+    op: str, table: str, msg: str, *args,
+    rows: int | None = None, start: float | None = None, duration: float | None = None,
+    level: int = logging.INFO, stacklevel: int = 1,
+):
+    """
+    log a database operation: nothing is formatted if the level is off,
+    otherwise `msg % args` plus the record fields op, table, rows, duration (given, or seconds since `start`);
+    stacklevel: as in logging, for wrappers of log_op
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if duration is None and start is not None:
+        duration = time.perf_counter() - start
+    logger.log(
+        level, msg, *args,
+        extra={"op": op, "table": table, "rows": rows, "duration": duration},
+        stacklevel=stacklevel + 1,
+    )
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    one JSON object per record, with the structured fields when the record has them
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": record.created,
+            "level": record.levelname,
+            "where": f"{record.module}:{record.funcName}:{record.lineno}",
+            "message": record.getMessage(),
+        }
+        for name in STRUCTURED_FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                data[name] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def add_json_file(path: str) -> logging.Handler:
+    handler = logging.FileHandler(path, encoding="utf-8")
+    handler.setFormatter(JsonFormatter())
+    logger.addHandler(handler)
+    return handler
+
+
+_listener: logging.handlers.QueueListener | None = None
+
+def start_queue_logging() -> logging.handlers.QueueListener:
+    """
+    move the handlers behind a queue: logging only puts the record in the queue,
+    formatting and I/O run on the listener thread; stop with stop_queue_logging()
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+    handlers = list(logger.handlers)
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+def stop_queue_logging():
+    """
+    write what is left in the queue and put the handlers back
+    """
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in list(logger.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            logger.removeHandler(handler)
+    for handler in _listener.handlers:
+        logger.addHandler(handler)
+    _listener = None
@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import threading
+from typing import Any
+
+
+# the progress handler is called every this many sqlite VM instructions
+PROGRESS_STEPS = 1000
+# histogram buckets: [0, 1us), [1us, 2us), [2us, 4us), ... the last one is open
+BUCKETS = 32
+
+
+class Histogram:
+    """
+    latencies in power-of-two microsecond buckets
+    """
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        i = min(int(seconds * 1e6).bit_length(), BUCKETS - 1)
+        self.counts[i] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p: float) -> float:
+        """
+        upper bound (seconds) of the bucket holding the p-th percentile
+        """
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min((1 << i) / 1e6, self.max)
+        return self.max
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max,
+            # "<upper bound in us>": count, only the non-empty buckets
+            "buckets": {f"<{1 << i}us": n for i, n in enumerate(self.counts) if n},
+        }
+
+
+class Metrics:
+    """
+    process-wide timings of the Dataset operations, and (with tracing on) counts of the SQL
+    statements and VM steps of every pooled connection
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency: dict[str, Histogram] = {}
+        self.rows: dict[str, int] = {}
+        self.statements: dict[str, int] = {}
+        self.vm_steps = 0
+        self.tracing = False
+        # (op, table, seconds, rows) of the latest operation
+        self.last: tuple[str, str, float, int] | None = None
+        self._dump_thread: threading.Thread | None = None
+        self._dump_stop = threading.Event()
+
+    def record(self, op: str, table: str, seconds: float, rows: int | None = None):
+        with self._lock:
+            hist = self.latency.get(op)
+            if hist is None:
+                hist = self.latency[op] = Histogram()
+            hist.add(seconds)
+            if rows is not None and rows > 0:
+                self.rows[op] = self.rows.get(op, 0) + rows
+            self.last = (op, table, seconds, rows or 0)
+
+    def on_statement(self, sql: str):
+        # set_trace_callback: every statement sqlite runs, also the ones inside executemany
+        kind = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else "?"
+        with self._lock:
+            self.statements[kind] = self.statements.get(kind, 0) + 1
+
+    def on_progress(self) -> int:
+        # set_progress_handler: 0 lets the statement go on
+        with self._lock:
+            self.vm_steps += PROGRESS_STEPS
+        return 0
+
+    def set_tracing(self, on: bool = True):
+        """
+        count statements and VM steps; pooled connections pick it up the next time they are borrowed
+        """
+        self.tracing = on
+
+    def reset(self):
+        with self._lock:
+            self.latency.clear()
+            self.rows.clear()
+            self.statements.clear()
+            self.vm_steps = 0
+            self.last = None
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            ops = {}
+            for op, hist in self.latency.items():
+                ops[op] = hist.as_dict()
+                ops[op]["rows"] = self.rows.get(op, 0)
+            last = None
+            if self.last is not None:
+                op, table, seconds, rows = self.last
+                last = {"op": op, "table": table, "seconds": seconds, "rows": rows}
+            return {
+                "time": time.time(),
+                "ops": ops,
+                "statements": dict(self.statements),
+                "vm_steps": self.vm_steps,
+                "last": last,
+            }
+
+    def dump(self, path: str):
+        # write then rename, a reader never sees half a file
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.stats(), f, indent=2)
+        os.replace(tmp, path)
+
+    def start_dump(self, path: str, interval: float = 10.0):
+        """
+        dump stats() to `path` every `interval` seconds on a daemon thread, until stop_dump()
+        """
+        self.stop_dump()
+        self._dump_stop.clear()
+
+        def loop():
+            while not self._dump_stop.wait(interval):
+                self.dump(path)
+            self.dump(path)
+
+        self._dump_thread = threading.Thread(target=loop, name="metrics-dump", daemon=True)
+        self._dump_thread.start()
+
+    def stop_dump(self):
+        if self._dump_thread is None:
+            return
+        self._dump_stop.set()
+        self._dump_thread.join()
+        self._dump_thread = None
+
+
+metrics = Metrics()
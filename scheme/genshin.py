@@ -1,4 +1,5 @@
-from db import VALUE, CONSTRAIN, Column, Constrain, Scheme
+from db import VALUE, CONSTRAIN, Column, Constrain, Index, Scheme
+from craft import eqv_sql, tier_columns
 
 genshin_scheme = Scheme()
 genshin_scheme.add_columns([
@@ -10,6 +11,17 @@ genshin_scheme.add_columns([
     Column("tier2_count", VALUE.INTEGER, default=0),
     Column("tier3_count", VALUE.INTEGER, default=0),
 ])
+genshin_scheme.set_natural_key("country", "open_day")
+genshin_scheme.track_changes()
+# built like the `Sort: Eqv` ORDER BY of cli.py (eqv_sql of the tier columns), or sqlite won't use them
+genshin_eqv = eqv_sql(tier_columns([col.name for col in genshin_scheme.column_list]))
+genshin_scheme.add_indexes([
+    Index("open_day"),
+    Index("country", "open_day"),
+    Index("item_name"),
+    Index(genshin_eqv, name="eqv"),
+    Index("open_day", genshin_eqv, name="open_day_eqv"),
+])
 
 genshin_init_data = [
     {'country': 'Mondstadt',    'open_day': 1,      'item_name': 'Freedom',      },
@@ -48,6 +60,16 @@ genshin_weapon_scheme.add_columns([
     Column("tier3_count", VALUE.INTEGER, default=0),
     Column("tier4_count", VALUE.INTEGER, default=0),
 ])
+genshin_weapon_scheme.set_natural_key("country", "open_day")
+genshin_weapon_scheme.track_changes()
+genshin_weapon_eqv = eqv_sql(tier_columns([col.name for col in genshin_weapon_scheme.column_list]))
+genshin_weapon_scheme.add_indexes([
+    Index("open_day"),
+    Index("country", "open_day"),
+    Index("item_name"),
+    Index(genshin_weapon_eqv, name="eqv"),
+    Index("open_day", genshin_weapon_eqv, name="open_day_eqv"),
+])
 
 genshin_weapon_init_data = [
     {"country": "Mondstadt",    "open_day": 1,      "item_name": "Scattered Piece of Decarabian's Dream",       },
@@ -1,4 +1,5 @@
-from db import VALUE, CONSTRAIN, Column, Constrain, Scheme
+from db import VALUE, CONSTRAIN, Column, Constrain, Index, Scheme
+from craft import eqv_sql, tier_columns
 
 starrail_scheme = Scheme()
 starrail_scheme.add_columns([
@@ -13,6 +14,16 @@ starrail_scheme.add_columns([
 # starrail_scheme.add_constrain(
 #     Constrain(CONSTRAIN.PRIMARY_KEY, "path, position")
 # )
+starrail_scheme.set_natural_key("path", "position")
+starrail_scheme.track_changes()
+# built like the `Sort: Eqv` ORDER BY of cli.py, or sqlite won't use it
+starrail_eqv = eqv_sql(tier_columns([col.name for col in starrail_scheme.column_list]))
+starrail_scheme.add_indexes([
+    Index("position"),
+    Index("path", "position"),
+    Index("item_name"),
+    Index(starrail_eqv, name="eqv"),
+])
 
 starrail_init_data = [
     {'path': 'Destruction',     'position': 1,      'item_name': 'Worldbreaker Blade',      },
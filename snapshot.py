@@ -0,0 +1,368 @@
+import sys
+import json
+import mmap
+import struct
+from array import array
+from pathlib import Path
+from typing import Any, Iterator
+
+from db import ConnectionPool, Dataset, DEFAULT_CHUNK_SIZE
+
+
+# example: uv run snapshot.py save genshin_materials
+#          uv run snapshot.py diff genshin_materials
+#          uv run snapshot.py restore genshin_materials genshin_materials.snap
+
+
+# file layout:
+#   MAGIC, version (u32), header length (u32), header (JSON),
+#   then the blocks of every column, each starting at a multiple of 8
+MAGIC = b"ALIDSNAP"
+VERSION = 1
+_PREFIX = struct.Struct("<8sII")
+
+# column kinds
+INTEGER = "i"   # int64
+REAL = "f"      # float64
+TEXT = "s"      # int64 offsets + utf-8 bytes
+DICT = "d"      # int32 codes into a TEXT dictionary, for columns repeating a few strings
+BLOB = "b"      # int64 offsets + bytes
+MIXED = "m"     # like BLOB, each value tagged by its type (sqlite lets a column hold any type)
+
+_INT64_MIN, _INT64_MAX = -(1 << 63), (1 << 63) - 1
+
+
+def _kind_of(values: list) -> str:
+    types = {type(v) for v in values if v is not None}
+    if types <= {int}:
+        if all(_INT64_MIN <= v <= _INT64_MAX for v in values if v is not None):
+            return INTEGER
+        return MIXED
+    if types <= {float}:
+        return REAL
+    if types <= {str}:
+        if len(set(values)) * 4 <= len(values):
+            return DICT
+        return TEXT
+    if types <= {bytes}:
+        return BLOB
+    return MIXED
+
+
+def _encode_mixed(value: Any) -> bytes:
+    if isinstance(value, bytes):
+        return b"b" + value
+    if isinstance(value, str):
+        return b"s" + value.encode("utf-8")
+    if isinstance(value, int):
+        return b"i" + str(value).encode()
+    return b"f" + repr(float(value)).encode()
+
+
+def _decode_mixed(data: memoryview) -> Any:
+    tag = data[:1].tobytes()
+    if tag == b"b":
+        return data[1:].tobytes()
+    if tag == b"s":
+        return str(data[1:], "utf-8")
+    if tag == b"i":
+        return int(data[1:].tobytes())
+    return float(data[1:].tobytes())
+
+
+def _null_bitmap(values: list) -> bytes | None:
+    if all(v is not None for v in values):
+        return None
+    bitmap = bytearray((len(values) + 7) // 8)
+    for i, v in enumerate(values):
+        if v is None:
+            bitmap[i >> 3] |= 1 << (i & 7)
+    return bytes(bitmap)
+
+
+def _encode_column(kind: str, values: list) -> list[tuple[str, bytes]]:
+    """
+    the named blocks of one column
+    """
+    blocks: list[tuple[str, bytes]] = []
+    nulls = _null_bitmap(values)
+    if nulls is not None:
+        blocks.append(("nulls", nulls))
+    if kind == DICT:
+        codes: dict[str, int] = {}
+        for v in values:
+            if v is not None and v not in codes:
+                codes[v] = len(codes)
+        blocks.append(("codes", array("i", [0 if v is None else codes[v] for v in values]).tobytes()))
+        values = list(codes)
+        kind = TEXT
+    if kind == INTEGER:
+        blocks.append(("values", array("q", [0 if v is None else v for v in values]).tobytes()))
+    elif kind == REAL:
+        blocks.append(("values", array("d", [0.0 if v is None else v for v in values]).tobytes()))
+    else:
+        if kind == TEXT:
+            encoded = [b"" if v is None else v.encode("utf-8") for v in values]
+        elif kind == BLOB:
+            encoded = [b"" if v is None else v for v in values]
+        else:
+            encoded = [b"" if v is None else _encode_mixed(v) for v in values]
+        offsets = array("q", [0])
+        total = 0
+        for e in encoded:
+            total += len(e)
+            offsets.append(total)
+        blocks.append(("offsets", offsets.tobytes()))
+        blocks.append(("data", b"".join(encoded)))
+    return blocks
+
+
+def write_snapshot(db: Dataset, path: Path | str) -> int:
+    """
+    write the table of `db` to a columnar snapshot, return the number of rows
+    """
+    assert db.cursor is not None
+    head = db.head()
+    names = [h[1] for h in head]
+    columns: list[list] = [[] for _ in names]
+    for row in db.iter_all(chunk_size=DEFAULT_CHUNK_SIZE):
+        for column, value in zip(columns, row):
+            column.append(value)
+    db.cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (db.table_name,))
+    found = db.cursor.fetchone()
+    # the scheme's idx_* indexes and the changelog's trg_* triggers (autoindexes have no sql)
+    db.cursor.execute(
+        "SELECT type, sql FROM sqlite_master WHERE type IN ('index', 'trigger') AND tbl_name = ? AND sql IS NOT NULL",
+        (db.table_name,),
+    )
+    extras = db.cursor.fetchall()
+    n = len(columns[0]) if columns else 0
+
+    header: dict[str, Any] = {
+        "table": db.table_name,
+        "sql": found[0] if found else None,
+        "indexes": [sql for kind, sql in extras if kind == "index"],
+        "triggers": [sql for kind, sql in extras if kind == "trigger"],
+        "rows": n,
+        "columns": [],
+    }
+    payload: list[bytes] = []
+    offset = 0
+    for h, values in zip(head, columns):
+        kind = _kind_of(values)
+        col_header: dict[str, Any] = {"name": h[1], "type": h[2], "pk": h[5], "kind": kind}
+        for block_name, data in _encode_column(kind, values):
+            col_header[block_name] = [offset, len(data)]
+            pad = -len(data) % 8
+            payload.append(data + b"\0" * pad)
+            offset += len(data) + pad
+        header["columns"].append(col_header)
+    del columns
+
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    header_bytes += b" " * (-(_PREFIX.size + len(header_bytes)) % 8)
+    with open(path, "wb") as f:
+        f.write(_PREFIX.pack(MAGIC, VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for data in payload:
+            f.write(data)
+    return n
+
+
+class Snapshot:
+    """
+    a memory-mapped snapshot, columns are read straight from the file without parsing;
+    use as a context manager, or close() it
+    """
+
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_len = _PREFIX.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{self.path} is not a snapshot")
+        if version != VERSION:
+            self.close()
+            raise ValueError(f"{self.path} has snapshot version {version}, expect {VERSION}")
+        self.header: dict[str, Any] = json.loads(bytes(self._mmap[_PREFIX.size : _PREFIX.size + header_len]))
+        self._base = _PREFIX.size + header_len
+        self.table_name: str = self.header["table"]
+        self.rows: int = self.header["rows"]
+        self.names: list[str] = [c["name"] for c in self.header["columns"]]
+        self._columns = {c["name"]: c for c in self.header["columns"]}
+        self._cache: dict[str, list] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type: Any, exc_val: Any, exc_tb: Any):
+        self.close()
+
+    def close(self):
+        self._cache.clear()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # views from raw() are still alive, the map goes with the last of them
+            pass
+        self._file.close()
+
+    def prikey(self) -> str | None:
+        for c in self.header["columns"]:
+            if c["pk"]:
+                return c["name"]
+        return None
+
+    def _block(self, col: dict, block_name: str) -> memoryview:
+        start, length = col[block_name]
+        start += self._base
+        return memoryview(self._mmap)[start : start + length]
+
+    def raw(self, name: str) -> memoryview:
+        """
+        zero-copy int64 / float64 view of an INTEGER / REAL column (nulls read as 0)
+        """
+        col = self._columns[name]
+        if col["kind"] not in (INTEGER, REAL):
+            raise TypeError(f"{name} is a {col['kind']} column, not a numeric one")
+        return self._block(col, "values").cast("q" if col["kind"] == INTEGER else "d")
+
+    def column(self, name: str) -> list:
+        """
+        the python values of a column, decoded once and cached
+        """
+        cached = self._cache.get(name)
+        if cached is not None:
+            return cached
+        col = self._columns[name]
+        kind = col["kind"]
+        if kind in (INTEGER, REAL):
+            values: list = self.raw(name).tolist()
+        else:
+            offsets = self._block(col, "offsets").cast("q")
+            data = self._block(col, "data")
+            chunks = [data[offsets[i] : offsets[i + 1]] for i in range(len(offsets) - 1)]
+            if kind == DICT:
+                words = [str(c, "utf-8") for c in chunks]
+                values = [words[code] for code in self._block(col, "codes").cast("i")]
+            elif kind == TEXT:
+                values = [str(c, "utf-8") for c in chunks]
+            elif kind == BLOB:
+                values = [bytes(c) for c in chunks]
+            else:
+                values = [_decode_mixed(c) if len(c) else None for c in chunks]
+        if "nulls" in col:
+            nulls = self._block(col, "nulls")
+            for i in range(self.rows):
+                if nulls[i >> 3] & (1 << (i & 7)):
+                    values[i] = None
+        self._cache[name] = values
+        return values
+
+    def iter_rows(self) -> Iterator[dict]:
+        columns = [self.column(name) for name in self.names]
+        for values in zip(*columns):
+            yield dict(zip(self.names, values))
+
+
+def _renamed(sql: str, old_name: str, new_name: str) -> str:
+    # an index / trigger of the old table, for the new one (see Dataset._rename_indexes / _rename_triggers)
+    if old_name == new_name:
+        return sql
+    for old, new in (
+        (f"idx_{old_name}_", f"idx_{new_name}_"), (f"trg_{old_name}_", f"trg_{new_name}_"),
+        (f" ON {old_name}", f" ON {new_name}"), (f"'{old_name}'", f"'{new_name}'"),
+    ):
+        sql = sql.replace(old, new)
+    return sql
+
+
+def restore_snapshot(path: Path | str, db_name: str, table_name: str | None = None, *, replace: bool = False) -> int:
+    """
+    create `table_name` (default: the snapshotted one) from the snapshot, with its indexes and
+    changelog triggers, return the number of rows; readers of the changelog reload it;
+    replace: drop the table first if it exists
+    """
+    with Snapshot(path) as snap:
+        table_name = table_name or snap.table_name
+        sql = snap.header["sql"]
+        if sql is None:
+            raise ValueError(f"{path} does not keep the table definition")
+        pool = ConnectionPool.get(db_name)
+        cursor = pool.connection().conn.cursor()
+        if pool.table_exists(cursor, table_name):
+            if not replace:
+                raise ValueError(f"{table_name} exists, restore with replace=True to drop it")
+            with Dataset(db_name, table_name) as db:
+                db._delete_table()
+        cursor.execute(sql.replace(snap.table_name, table_name, 1))
+        cursor.close()
+        pool.remember_table(table_name)
+        with Dataset(db_name, table_name) as db:
+            rows = snap.iter_rows()
+            batch: list[dict] = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= DEFAULT_CHUNK_SIZE:
+                    db.store_many(batch, analyze=False)
+                    batch = []
+            db.store_many(batch, analyze=False)
+            # after the rows: the indexes are built once, the triggers do not log every row
+            for sql in snap.header.get("indexes", []) + snap.header.get("triggers", []):
+                db.cursor.execute(_renamed(sql, snap.table_name, table_name))
+            db._note_own_ddl()
+            db._log_reset(table_name)
+            db.analyze()
+        return snap.rows
+
+
+def diff_snapshot(snap: Snapshot, rows: Iterator[dict], key: str | None = None) -> tuple[list, list, list]:
+    """
+    compare the snapshot to other rows by primary key (or `key`):
+    return (keys only in rows, keys only in snapshot, keys whose values differ)
+    """
+    key = key or snap.prikey()
+    if key is None:
+        raise ValueError("snapshot has no primary key, specify one")
+    key_column = snap.column(key)
+    index = {k: i for i, k in enumerate(key_column)}
+    columns = {name: snap.column(name) for name in snap.names}
+    added: list = []
+    changed: list = []
+    seen: set = set()
+    for row in rows:
+        k = row.get(key)
+        i = index.get(k)
+        if i is None:
+            added.append(k)
+            continue
+        seen.add(k)
+        if any(columns[name][i] != row.get(name) for name in snap.names):
+            changed.append(k)
+    removed = [k for k in key_column if k not in seen]
+    return added, removed, changed
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in ("save", "restore", "diff"):
+        print("usage: snapshot.py save|restore|diff <table_name> [snapshot_file]")
+        exit(1)
+    command, name = sys.argv[1], sys.argv[2]
+    path = Path(sys.argv[3]) if len(sys.argv) > 3 else Path(f"{name}.snap")
+
+    if command == "save":
+        with Dataset("game.db", name) as db:
+            n = write_snapshot(db, path)
+        print(f"{name} table snapshot ({n} rows) wrote to {path}")
+    elif command == "restore":
+        n = restore_snapshot(path, "game.db", name, replace=True)
+        print(f"{path} ({n} rows) restored to {name}")
+    else:
+        with Snapshot(path) as snap, Dataset("game.db", name) as db:
+            added, removed, changed = diff_snapshot(snap, (dict(r) for r in db.iter_all(as_dict=True)))
+        print(f"{name} since {path}: {len(added)} added, {len(removed)} removed, {len(changed)} changed")
+        for title, keys in (("added", added), ("removed", removed), ("changed", changed)):
+            if keys:
+                print(f"  {title}: {keys[:20]}{' ...' if len(keys) > 20 else ''}")
@@ -1,16 +1,73 @@
 import sys
-import json
-from db import Dataset, Column, VALUE
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from db import Dataset, Column, VALUE, table_names
+from jsonio import open_json, write_json_array, write_json_lines
 
 
 # example: uv run table-to-json.py genshin_weapon
+#          uv run table-to-json.py genshin_weapon --format jsonl --gzip
+#          uv run table-to-json.py --all --workers 4
+#          uv run table-to-json.py --all --include-backups
+
+
+def export_table(db_file: str, name: str, json_lines: bool, compress: bool, chunk_size: int) -> str:
+    """
+    stream the table to <name>.json / <name>.jsonl (+ .gz), return a one-line report
+    """
+    path = Path(f"{name}.jsonl" if json_lines else f"{name}.json")
+    if compress:
+        path = path.with_name(path.name + ".gz")
+    write = write_json_lines if json_lines else write_json_array
+    start = time.perf_counter()
+    with Dataset(db_file, name) as db, open_json(path, "w") as f:
+        head = db.head_name()
+        # tuples and one shared head are lighter than a sqlite3.Row per row
+        n = write(f, (dict(zip(head, row)) for row in db.iter_all(chunk_size=chunk_size)))
+    elapsed = time.perf_counter() - start
+    return f"{name} table data wrote to {path} ({n} rows, {elapsed:.2f}s)"
+
+
+def all_tables(db_file: str, include_backups: bool) -> list[str]:
+    """
+    the tables --all exports: not the <name>_backup tables json-to-table.py leaves
+    (their export would overwrite its <name>_backup.json) nor the `_` internal ones, unless asked
+    """
+    names = table_names(db_file)
+    if include_backups:
+        return names
+    return [name for name in names if not name.startswith("_") and not name.endswith("_backup")]
+
 
 if __name__ == "__main__":
-    name = sys.argv[1]
-    with Dataset(
-        "game.db", name,
-    ) as db:
-        dq = db.dquery_all()
-    with open(f"{name}.json",'w') as f:
-        f.write(json.dumps(dq, ensure_ascii=False))
-        print(f"{name} table data wrote to {name}.json")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("names", nargs="*", help="table names")
+    parser.add_argument("--all", action="store_true", help="export every table of the database")
+    parser.add_argument("--include-backups", action="store_true", help="with --all, also the *_backup and _* tables")
+    parser.add_argument("--format", choices=["json", "jsonl"], default="json", help="JSON array or JSON Lines")
+    parser.add_argument("--gzip", action="store_true", help="compress to .gz")
+    parser.add_argument("--workers", type=int, default=4, help="tables exported at the same time")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="rows fetched at a time")
+    args = parser.parse_args()
+
+    db_file = "game.db"
+    names: list[str] = all_tables(db_file, args.include_backups) if args.all else args.names
+    if not names:
+        parser.print_usage()
+        sys.exit(1)
+
+    json_lines = args.format == "jsonl"
+    if len(names) == 1:
+        print(export_table(db_file, names[0], json_lines, args.gzip, args.chunk_size))
+    else:
+        # one pooled connection per worker thread
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            futures = [
+                executor.submit(export_table, db_file, name, json_lines, args.gzip, args.chunk_size)
+                for name in names
+            ]
+            for future in futures:
+                print(future.result())
@@ -63,3 +63,283 @@ with Dataset(
     "game.db", "starrail_materials_just_for_test",
 ) as db:
     db._delete_table()
+
+
+print(START + "TEST 3" + END)
+
+import importlib
+merge_stream = importlib.import_module("json-to-table").merge_stream
+
+with Dataset(
+    "game.db", "genshin_merge_just_for_test",
+    create_scheme=genshin_scheme,
+    create_data=genshin_init_data,
+) as db:
+    # two rows added in the TUI, the same empty natural key
+    db.store({'country': '', 'open_day': '', 'item_name': 'a', 'tier1_count': 1})
+    db.store({'country': '', 'open_day': '', 'item_name': 'b', 'tier1_count': 2})
+    export = db.dquery_all()
+    summary = merge_stream(db, export, ("country", "open_day"), "id", True, 1000)
+    print(f"{summary = }")
+    print(f"{db.dquery_all() == export = }")
+
+    rows = [{k: v for k, v in row.items() if k != 'id'} for row in export]
+    rows[-1]['tier1_count'] = 3
+    rows[0]['tier1_count'] = 4
+    summary = merge_stream(db, rows, ("country", "open_day"), "id", False, 1000)
+    print(f"{summary = }")
+    print(f"{db.dquery_constrain({'country': ''}) = }")
+    print(f"{db.dquery_constrain({'id': 1})[0]['tier1_count'] = }")
+    db._delete_table()
+
+
+print(START + "TEST 4" + END)
+
+import asyncio
+from cli import AppState
+
+state = AppState(
+    "game.db", "starrail_state_just_for_test",
+    create_scheme=starrail_scheme,
+    create_data=starrail_init_data,
+)
+state.update(1, {'tier1_count': 2, 'tier2_count': 3})
+print(f"{str(state._row_by_key(1)['eqv']) = }")
+# id 2 is taken: the write fails and the row is put back
+print(f"{asyncio.run(state.update_async(1, {'id': 2, 'tier3_count': 1})) = }")
+print(f"{state.info_text = }")
+print(f"{str(state._row_by_key(1)['eqv']) = }")
+print(f"{asyncio.run(state.update_async(1, {'id': 2})) = }")
+print(f"{str(state._row_by_key(1)['eqv']) = }")
+state.adb.call(lambda db: db._delete_table())
+state.adb.close()
+
+
+print(START + "TEST 5" + END)
+
+from cli import make_eqv_order
+
+with Dataset(
+    "game.db", "genshin_plan_just_for_test",
+    create_scheme=genshin_scheme,
+    create_data=genshin_init_data,
+) as db:
+    # the `Sort: Eqv` page query of the virtual view goes through the eqv indexes
+    order_by = ", ".join(make_eqv_order(db.head_name()) + ["id"])
+    for where in ("", " WHERE open_day = 1"):
+        db.cursor.execute(f"EXPLAIN QUERY PLAN SELECT * FROM {db.table_name}{where} ORDER BY {order_by} LIMIT 10")
+        plan = " ".join(row[-1] for row in db.cursor.fetchall())
+        print(f"{where = }, {'_eqv' in plan and 'TEMP B-TREE' not in plan = }")
+    db._delete_table()
+
+
+print(START + "TEST 6" + END)
+
+import io
+import jsonio
+
+rows = [{"id": 1, "item_name": "风神瞳", "tier1_count": 1.5}, {"id": 2, "item_name": "a, b]", "note": None}]
+data = ' [ {"id": 1, "item_name": "风神瞳", "tier1_count": 1.5} ,\n{"id": 2, "item_name": "a, b]", "note": null}]\n'
+lines = '{"id": 1, "item_name": "风神瞳", "tier1_count": 1.5}\n\n{"id": 2, "item_name": "a, b]", "note": null}\n'
+
+
+def tiny_reads(text: str) -> io.TextIOWrapper:
+    # a file that hands out 3 characters per read, so tokens and multi-byte characters are cut
+    f = io.TextIOWrapper(io.BufferedReader(io.BytesIO(text.encode()), buffer_size=3), encoding="utf-8")
+    f._CHUNK_SIZE = 3  # type: ignore
+    return f
+
+
+read_size = jsonio.READ_SIZE
+jsonio.READ_SIZE = 3
+try:
+    print(f"{list(jsonio.iter_json_rows(tiny_reads(data))) == rows = }")
+    print(f"{list(jsonio.iter_json_rows(tiny_reads(data), False)) == rows = }")
+    print(f"{list(jsonio.iter_json_rows(tiny_reads(lines))) == rows = }")
+    print(f"{list(jsonio.iter_json_rows(tiny_reads(lines), True)) == rows = }")
+    try:
+        list(jsonio.iter_json_rows(tiny_reads(data[:-3]), False))
+    except ValueError as e:
+        print(f"{e = }")
+finally:
+    jsonio.READ_SIZE = read_size
+
+
+print(START + "TEST 7" + END)
+
+import os
+from db import Scheme, Index
+from snapshot import Snapshot, write_snapshot, restore_snapshot
+
+snap_scheme = Scheme()
+snap_scheme.add_columns([
+    Column("id", VALUE.INTEGER, primary=True),
+    Column("note", VALUE.TEXT),
+    Column("value", VALUE.BLOB),  # BLOB affinity keeps every type as it is
+    Column("data", VALUE.BLOB),
+])
+snap_scheme.track_changes()
+snap_scheme.add_indexes([Index("note")])
+snap_rows = [
+    {'id': 1, 'note': None, 'value': None, 'data': None},
+    {'id': 2, 'note': '风神瞳', 'value': 7, 'data': b''},
+    {'id': 3, 'note': '', 'value': 2.5, 'data': b'\x00\xff\x00'},
+    {'id': 4, 'note': 'a', 'value': 'text', 'data': bytes(range(256))},
+    {'id': 5, 'note': None, 'value': b'\x01raw', 'data': None},
+    {'id': 6, 'note': 'a', 'value': -(1 << 63), 'data': b'x'},
+]
+with Dataset("game.db", "snapshot_just_for_test", create_scheme=snap_scheme, create_data=snap_rows) as db:
+    print(f"{write_snapshot(db, 'snapshot_just_for_test.snap') = }")
+try:
+    with Snapshot("snapshot_just_for_test.snap") as snap:
+        print(f"{list(snap.iter_rows()) == snap_rows = }")
+    print(f"{restore_snapshot('snapshot_just_for_test.snap', 'game.db', replace=True) = }")
+    with Dataset("game.db", "snapshot_just_for_test") as db:
+        restored = db.dquery_all()
+        print(f"{restored == snap_rows = }")
+        print(f"{[type(row['value']).__name__ for row in restored] = }")
+        db.cursor.execute("SELECT name FROM sqlite_master WHERE tbl_name = ? AND sql IS NOT NULL ORDER BY name", (db.table_name,))
+        print(f"{[row[0] for row in db.cursor.fetchall()] = }")
+        db._delete_table()
+finally:
+    os.remove("snapshot_just_for_test.snap")
+
+
+print(START + "TEST 8" + END)
+
+with Dataset(
+    "game.db", "starrail_tx_just_for_test",
+    create_scheme=starrail_scheme,
+    create_data=starrail_init_data,
+) as db:
+    rows = len(db.dquery_all())
+    try:
+        with db.transaction():
+            db.update_where({'id': 1}, {'tier1_count': 9})
+            db.store({'path': 'Test', 'position': 1, 'item_name': 'rolled back'})
+            raise KeyError("in the transaction")
+    except KeyError as e:
+        print(f"{e = }")
+    print(f"{len(db.dquery_all()) == rows = }")
+    print(f"{db.dquery_constrain({'id': 1})[0]['tier1_count'] = }")
+
+    with db.transaction():
+        db.update_where({'id': 1}, {'tier1_count': 1})
+        try:
+            with db.savepoint():
+                db.update_where({'id': 1}, {'tier1_count': 2})
+                db.update_where({'id': 2}, {'tier2_count': 2})
+                raise ValueError("in the savepoint")
+        except ValueError as e:
+            print(f"{e = }")
+        with db.transaction():  # nested: a savepoint
+            db.update_where({'id': 1}, {'tier3_count': 3})
+    print(f"{db.dquery_constrain({'id': 1})[0]['tier1_count'] = }")
+    print(f"{db.dquery_constrain({'id': 1})[0]['tier3_count'] = }")
+    print(f"{db.dquery_constrain({'id': 2})[0]['tier2_count'] = }")
+    print(f"{db.conn.in_transaction = }")
+    try:
+        with db.savepoint():
+            db.commit()
+    except RuntimeError as e:
+        print(f"{e = }")
+    db._delete_table()
+
+
+print(START + "TEST 9" + END)
+
+import sqlite3
+
+
+def delta(before: dict, after: dict, *names: str) -> dict:
+    return {name: after[name] - before[name] for name in names}
+
+
+with Dataset(
+    "game.db", "starrail_cache_just_for_test",
+    create_scheme=starrail_scheme,
+    create_data=starrail_init_data,
+    cache=True,
+) as db:
+    # the same statement shape is built once, then served from the cache
+    before = db.statement_stats()
+    for i in range(5):
+        db.update_where({'id': 1}, {'tier1_count': i})
+    db.update_where({'id': 1}, {'tier2_count': 1})
+    db.commit()  # results are not cached inside a transaction
+    print(f"{delta(before, db.statement_stats(), 'hits', 'misses') = }")
+
+    before = db.result_stats()
+    for _ in range(3):
+        db.dquery_constrain({'id': 1})
+    print(f"{delta(before, db.result_stats(), 'hits', 'misses', 'invalidations') = }")
+    # our own write drops the table's results
+    db.update_where({'id': 1}, {'tier3_count': 1})
+    db.commit()
+    print(f"{db.dquery_constrain({'id': 1})[0]['tier3_count'] = }")
+    print(f"{delta(before, db.result_stats(), 'hits', 'misses', 'invalidations') = }")
+    # another connection commits: PRAGMA data_version moves on and everything is dropped
+    before = db.result_stats()
+    db.dquery_constrain({'id': 1})
+    other = sqlite3.connect("game.db")
+    other.execute(f"UPDATE {db.table_name} SET tier3_count = 2 WHERE id = 1")
+    other.commit()
+    other.close()
+    print(f"{db.dquery_constrain({'id': 1})[0]['tier3_count'] = }")
+    print(f"{delta(before, db.result_stats(), 'hits', 'misses', 'invalidations') = }")
+    # DDL drops the results too
+    before = db.result_stats()
+    db.dquery_constrain({'id': 1})
+    db._add_column(Column("hello", VALUE.REAL))
+    print(f"{'hello' in db.dquery_constrain({'id': 1})[0] = }")
+    print(f"{delta(before, db.result_stats(), 'hits', 'misses', 'invalidations') = }")
+    db._delete_table()
+
+# few rows but long values: the byte budget evicts before the row limit
+from db import ResultCache
+
+results = ResultCache(max_rows=100, max_bytes=10000)
+for i in range(5):
+    results.put(("q", i), "t", ((i, "x" * 3000),), 1)
+print(f"{list(results._results) = }, {results.rows = }, {results.bytes <= results.max_bytes = }")
+results.put(("big",), "t", ((0, b"x" * 20000),), 1)
+print(f"{results.get(('big',)) = }")
+results.invalidate("t")
+print(f"{results.stats()['bytes'] = }")
+
+
+print(START + "TEST 10" + END)
+
+state = AppState(
+    "game.db", "starrail_patch_just_for_test",
+    create_scheme=starrail_scheme,
+    create_data=starrail_init_data,
+)
+
+
+def patched_ok(state: AppState) -> bool:
+    # the patched table / view / key index hold what a reload reads
+    shown = [state.row_at(i) for i in range(state.row_count())]
+    index_ok = all(state.table.get(state._pos_by_key.get(row['id']), 'id') == row['id'] for row in shown)
+    index_ok = index_ok and len(state._pos_by_key) == len(state.table) == len(shown)
+    eqvs = [row['eqv'] for row in shown]
+    sorted_ok = all(not b < a for a, b in zip(eqvs, eqvs[1:])) if state.sort_enabled else None
+    state.load_data()
+    reloaded = [state.row_at(i) for i in range(state.row_count())]
+    by_id = lambda rows: sorted((row['id'], str(row)) for row in rows)
+    return index_ok and by_id(shown) == by_id(reloaded) and sorted_ok is not False
+
+
+for sort_enabled in (0, 1):
+    state.sort_enabled = sort_enabled
+    state.apply_filter_and_sort()
+    print(f"{sort_enabled = }")
+    print(f"{state.update(3 + sort_enabled, {'tier1_count': 30}) = }, {patched_ok(state) = }")
+    old_id, new_id = 5 + sort_enabled, 100 + sort_enabled
+    print(f"{state.update(old_id, {'id': new_id, 'tier3_count': 2}) = }, {patched_ok(state) = }")
+    print(f"{state._row_by_key(old_id) = }, {state._row_by_key(new_id)['tier3_count'] = }")
+    new_row = {'id': 200 + sort_enabled, 'path': 'Test', 'position': sort_enabled, 'item_name': 'new', 'tier2_count': 5}
+    print(f"{state.insert(new_row) = }, {patched_ok(state) = }")
+    print(f"{state.delete(new_id) = }, {patched_ok(state) = }, {state._row_by_key(new_id) = }")
+state.adb.call(lambda db: db._delete_table())
+state.adb.close()
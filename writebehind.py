@@ -0,0 +1,152 @@
+import os
+import json
+import time
+from pathlib import Path
+from typing import Any
+
+from db import AsyncDataset, Dataset
+from logger import logger # type: ignore
+
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def _lock_file(path: Path):
+    """
+    open `path` and take an exclusive lock on it, held until the file is closed
+    (or the process ends); BlockingIOError if another process holds it
+    """
+    f = open(path, "a+b")
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        raise BlockingIOError(f"{path} is locked by another process") from None
+    return f
+
+
+class WriteBehind:
+    """
+    row updates kept in memory, the ones of the same row merged into one, and written later
+    as one Batch (one transaction): when idle, on save, on quit;
+    every update is appended to a journal file first, recover() replays it after a crash
+    (the journal is flushed but not fsynced: it survives the program, not the OS);
+    one process at a time owns the journal, by a lock on `<journal>.lock`:
+    BlockingIOError if another one (e.g. a second cli.py on the table) holds it
+    """
+
+    def __init__(self, adb: AsyncDataset, prikey_field: str, journal: Path | str, idle_seconds: float = 2.0):
+        self.adb = adb
+        self.prikey_field = prikey_field
+        self.journal = Path(journal)
+        self._lock = _lock_file(self.journal.with_name(self.journal.name + ".lock"))
+        self.idle_seconds = idle_seconds
+        # prikey -> merged set_dict
+        self.pending: dict[Any, dict[str, Any]] = {}
+        self.last_edit = 0.0
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def close(self):
+        """
+        let another process own the journal (after the last flush)
+        """
+        self._lock.close()
+
+    def update(self, prikey_value: Any, set_dict: dict[str, Any]):
+        with open(self.journal, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"key": prikey_value, "set": set_dict}, ensure_ascii=False) + "\n")
+        self.pending.setdefault(prikey_value, {}).update(set_dict)
+        self.last_edit = time.monotonic()
+
+    def idle(self) -> bool:
+        """
+        True if there is something to write and no edit for idle_seconds
+        """
+        return bool(self.pending) and time.monotonic() - self.last_edit >= self.idle_seconds
+
+    def recover(self) -> int:
+        """
+        take back the updates a crashed run left in the journal, return the number of rows
+        """
+        if not self.journal.exists():
+            return 0
+        with open(self.journal, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line may be cut by the crash
+                    logger.warning("[%s]: journal line ignored: %.80r", self.journal, line)
+                    break
+                self.pending.setdefault(entry["key"], {}).update(entry["set"])
+        return len(self.pending)
+
+    def _write(self, db: Dataset, edits: dict[Any, dict[str, Any]]) -> int:
+        # on the database thread
+        with db.batch() as batch:
+            for prikey_value, set_dict in edits.items():
+                batch.update_where({self.prikey_field: prikey_value}, set_dict)
+        return len(edits)
+
+    def _take(self) -> dict[Any, dict[str, Any]]:
+        edits = self.pending
+        self.pending = {}
+        return edits
+
+    def _put_back(self, edits: dict[Any, dict[str, Any]]):
+        # the write failed: keep them, under the updates made since
+        for prikey_value, set_dict in edits.items():
+            newer = self.pending.get(prikey_value)
+            self.pending[prikey_value] = {**set_dict, **newer} if newer else set_dict
+
+    def _compact_journal(self):
+        # keep only what is still pending (updates made while writing)
+        if not self.pending:
+            if self.journal.exists():
+                self.journal.unlink()
+            return
+        tmp = self.journal.with_name(self.journal.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for prikey_value, set_dict in self.pending.items():
+                f.write(json.dumps({"key": prikey_value, "set": set_dict}, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.journal)
+
+    def flush_sync(self) -> int:
+        """
+        write the pending updates and wait, return the number of rows
+        """
+        if not self.pending:
+            return 0
+        edits = self._take()
+        try:
+            n = self.adb.call(self._write, edits)
+        except BaseException:
+            self._put_back(edits)
+            raise
+        self._compact_journal()
+        return n
+
+    async def flush(self) -> int:
+        """
+        like flush_sync, for `await`
+        """
+        if not self.pending:
+            return 0
+        edits = self._take()
+        try:
+            n = await self.adb.run(self._write, edits)
+        except BaseException:
+            self._put_back(edits)
+            raise
+        self._compact_journal()
+        return n